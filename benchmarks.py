@@ -0,0 +1,741 @@
+'''Micro-benchmarks for groper.
+
+Run all of them with:
+
+    $ python benchmarks.py
+
+or only some of them by name:
+
+    $ python benchmarks.py parse_args
+
+The suite benchmark times every phase of groper on synthetic schemas of 10 to
+100000 options, and init_options() cold start in a fresh interpreter. It can
+save its results as JSON and compare them with a baseline, exiting with status
+1 if any phase got slower than --threshold times the baseline:
+
+    $ python benchmarks.py --json=baseline.json suite
+    $ python benchmarks.py --compare=baseline.json --json=current.json suite
+
+Options must come before the benchmark names.
+'''
+
+import os, sys, tempfile, timeit, tracemalloc, random, json, platform, subprocess
+
+import groper
+from groper import OptionsMeta, ListOf, duration, validate_files
+
+
+def _timeit(func, number):
+    '''Returns the best per-call time of func in microseconds.'''
+
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+def _define_cmd_options(define_opt, count):
+    for i in range(count):
+        define_opt('section{0}'.format(i % 10), 'opt{0}'.format(i), type=int, cmd_name='opt-{0}'.format(i), default=0)
+
+def bench_parse_args():
+    '''parse_args() per-call cost should not depend on the number of defined options.'''
+
+    argv = ['--opt-1=1', '--opt-2', '2', 'file1', 'file2']
+
+    for count in (10, 100, 1000, 10000):
+        scope = OptionsMeta(lambda s: None)
+        _define_cmd_options(scope.define_opt, count)
+        scope.compile_schema(freeze=True)
+
+        print('parse_args, {0:>6} options: {1:8.2f} us/call'.format(count, _timeit(lambda: scope.parse_args(argv), 2000)))
+
+def _define_config_options(define_opt, count):
+    for i in range(count):
+        define_opt('section{0}'.format(i % 20), 'opt{0}'.format(i), type=(int, float, str, bool)[i % 4])
+
+def _write_config(filename, count):
+    values = ('1', '1.5', 'value', 'yes')
+    with open(filename, 'w') as fp:
+        for section in range(20):
+            fp.write('[section{0}]\n'.format(section))
+            for i in range(section, count, 20):
+                fp.write('opt{0} = {1}\n'.format(i, values[i % 4]))
+
+def bench_config_cache():
+    '''parse_config() with a cold versus a warm resolved-config cache.'''
+
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'bench.conf')
+    cache_file = os.path.join(tmpdir, 'bench.cache')
+
+    def parse(count, hit):
+        scope = OptionsMeta(lambda s: None)
+        _define_config_options(scope.define_opt, count)
+        if not hit and os.path.exists(cache_file):
+            os.unlink(cache_file)
+
+        start = timeit.default_timer()
+        scope.parse_config(filename, cache_file)
+        return timeit.default_timer() - start
+
+    try:
+        for count in (100, 1000, 10000):
+            _write_config(filename, count)
+            miss = min(parse(count, False) for _ in range(5))
+            hit = min(parse(count, True) for _ in range(5))
+            print('parse_config cache, {0:>6} options: miss {1:8.2f} ms, hit {2:8.2f} ms'.format(count, miss * 1e3, hit * 1e3))
+    finally:
+        for name in os.listdir(tmpdir):
+            os.unlink(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+def bench_streaming_config():
+    '''parse_config() time and peak memory, RawConfigParser versus streaming, on a file mostly made of foreign sections.'''
+
+    fd, filename = tempfile.mkstemp()
+    with os.fdopen(fd, 'w') as fp:
+        for section in range(2000):
+            fp.write('[foreign{0}]\n'.format(section))
+            for i in range(100):
+                fp.write('key{0} = some value for another tool {1}\n'.format(i, section))
+        for section in range(20):
+            fp.write('[section{0}]\n'.format(section))
+            for i in range(section, 1000, 20):
+                fp.write('opt{0} = {1}\n'.format(i, ('1', '1.5', 'value', 'yes')[i % 4]))
+
+    def parse(streaming, trace):
+        scope = OptionsMeta(lambda s: None)
+        _define_config_options(scope.define_opt, 1000)
+
+        if trace:
+            tracemalloc.start()
+        start = timeit.default_timer()
+        scope.parse_config(filename, streaming=streaming)
+        elapsed = timeit.default_timer() - start
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak
+        return elapsed
+
+    try:
+        print('config file: {0:.1f} MB'.format(os.path.getsize(filename) / 1e6))
+        for streaming in (False, True):
+            elapsed, peak = parse(streaming, False), parse(streaming, True)
+            print('parse_config, streaming={0!s:5}: {1:8.2f} ms, peak {2:8.2f} MB'.format(streaming, elapsed * 1e3, peak / 1e6))
+    finally:
+        os.unlink(filename)
+
+def bench_lazy_init():
+    '''Time from init_options() to the first access of a command line option and of a configuration file option.'''
+
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    _write_config(filename, 10000)
+
+    def measure(lazy):
+        scope = OptionsMeta(lambda s: None)
+        _define_config_options(scope.define_opt, 10000)
+        scope.define_opt('cmd', 'version', type=bool, cmd_name='version')
+
+        start = timeit.default_timer()
+        scope.init_options(['--version'], config_file=filename, streaming=True, lazy=lazy)
+        cmd_access = scope.options.cmd.version and timeit.default_timer() - start
+        scope.options.section1.opt1
+        return cmd_access, timeit.default_timer() - start
+
+    try:
+        for lazy in (False, True):
+            cmd_access, config_access = min(measure(lazy) for _ in range(5))
+            print('init_options, lazy={0!s:5}: first command line option {1:8.2f} ms, first config option {2:8.2f} ms'.format(lazy, cmd_access * 1e3, config_access * 1e3))
+    finally:
+        os.unlink(filename)
+
+def bench_schema_memory():
+    '''Memory used by the option definitions and resolved values of large schemas.'''
+
+    for count in (10000, 100000):
+        tracemalloc.start()
+        scope = OptionsMeta(lambda s: None)
+        for i in range(count):
+            scope.define_opt('section{0}'.format(i % 100), 'opt{0}'.format(i), type=int, default=i)
+        defined = tracemalloc.get_traced_memory()[0]
+        scope.set_defaults()
+        resolved = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print('schema memory, {0:>6} options: definitions {1:7.2f} MB ({2:4.0f} B/option), values {3:7.2f} MB'.format(count, defined / 1e6, defined / count, (resolved - defined) / 1e6))
+
+def bench_define_opts():
+    '''Defining a table-driven schema with define_opts() versus a loop of define_opt() calls.'''
+
+    for count in (1000, 10000):
+        table = [('section{0}'.format(i % 50), 'opt{0}'.format(i), {'type': int, 'cmd_name': 'opt-{0}'.format(i), 'default': i}) for i in range(count)]
+
+        def loop():
+            scope = OptionsMeta(lambda s: None)
+            for section, name, kwargs in table:
+                scope.define_opt(section, name, **kwargs)
+
+        def bulk():
+            OptionsMeta(lambda s: None).define_opts(table)
+
+        print('define {0:>6} options: define_opt loop {1:8.2f} ms, define_opts {2:8.2f} ms'.format(count, _timeit(loop, 3) / 1e3, _timeit(bulk, 3) / 1e3))
+
+def bench_usage():
+    '''usage() and generate_sample_config() on repeated calls.'''
+
+    for count in (100, 1000, 10000):
+        scope = OptionsMeta(lambda s: None)
+        _define_cmd_options(scope.define_opt, count)
+
+        first = _timeit(lambda: (scope.define_args((-1, 'file')), scope.usage('prog'), scope.generate_sample_config()), 1)
+        repeated = _timeit(lambda: (scope.usage('prog'), scope.generate_sample_config()), 1000)
+        print('usage + sample config, {0:>6} options: after define {1:10.2f} us, repeated {2:6.2f} us'.format(count, first, repeated))
+
+def bench_commands():
+    '''Cold start of a 40 command tool, with every option defined up front versus per-command loaders.'''
+
+    def define_command_options(define_opt, command):
+        for i in range(10):
+            define_opt(command, 'opt{0}'.format(i), type=int, cmd_name='{0}-opt-{1}'.format(command, i), default=0)
+
+    def flat():
+        scope = OptionsMeta(lambda s: None)
+        for c in range(40):
+            define_command_options(scope.define_opt, 'cmd{0}'.format(c))
+        scope.parse_args(['--cmd7-opt-1=1', 'file'])
+
+    def lazy():
+        scope = OptionsMeta(lambda s: None)
+        for c in range(40):
+            command = 'cmd{0}'.format(c)
+            scope.define_command(command, lambda command=command: define_command_options(scope.define_opt, command))
+        scope.parse_args(['cmd7', '--cmd7-opt-1=1', 'file'])
+
+    print('cold start, 40 commands x 10 options: flat {0:8.2f} us, lazy commands {1:8.2f} us'.format(_timeit(flat, 200), _timeit(lazy, 200)))
+
+def bench_verify():
+    '''set_defaults() and verify_all_options() once every option has a value, which should not depend on the number of options.'''
+
+    for count in (100, 1000, 10000, 100000):
+        scope = OptionsMeta(lambda s: None)
+        for i in range(count):
+            scope.define_opt('section{0}'.format(i % 100), 'opt{0}'.format(i), type=int, default=i)
+        scope.set_defaults()
+
+        print('set_defaults + verify_all_options, {0:>6} options: {1:8.2f} us/call'.format(count, _timeit(lambda: (scope.set_defaults(), scope.verify_all_options()), 1000)))
+
+def bench_converters():
+    '''Converting a list of 10000 shard IDs: first parse, memoized parse and memory compared with a list of ints.'''
+
+    from groper import ListOf
+
+    raw = ', '.join(str(i) for i in range(0, 20000, 2))
+    scope = OptionsMeta(lambda s: None)
+    scope.define_opt('shards', 'ids', type=ListOf(int), cmd_name='ids')
+    argv = ['--ids', raw]
+
+    first = _timeit(lambda: ListOf(int)(raw), 20)
+    memoized = _timeit(lambda: scope.parse_args(argv), 200)
+
+    tracemalloc.start()
+    values = ListOf(int)(raw)
+    compact = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del values
+
+    tracemalloc.start()
+    values = [int(item) for item in raw.split(',')]
+    plain = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del values
+
+    print('ListOf(int), 10000 items: parse {0:8.2f} us, memoized {1:8.2f} us, array {2:6.1f} kB, list {3:6.1f} kB'.format(first, memoized, compact / 1e3, plain / 1e3))
+
+def bench_compiled():
+    '''init_options() from a configuration file, from a warm cache file and from compiled options.'''
+
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'bench.conf')
+    cache_file = os.path.join(tmpdir, 'bench.cache')
+    compiled = os.path.join(tmpdir, 'bench.compiled')
+
+    def init(count, **kwargs):
+        scope = OptionsMeta(lambda s: None)
+        _define_config_options(scope.define_opt, count)
+        start = timeit.default_timer()
+        scope.init_options([], **kwargs)
+        return scope, timeit.default_timer() - start
+
+    try:
+        for count in (100, 1000, 10000):
+            _write_config(filename, count)
+            init(count, config_file=filename)[0].compile_options(compiled)
+            init(count, config_file=filename, cache_file=cache_file)
+
+            parsed = min(init(count, config_file=filename)[1] for _ in range(5))
+            cached = min(init(count, config_file=filename, cache_file=cache_file)[1] for _ in range(5))
+            loaded = min(init(count, compiled=compiled)[1] for _ in range(5))
+            print('init_options, {0:>6} options: parsed {1:8.2f} ms, cached {2:8.2f} ms, compiled {3:8.2f} ms'.format(count, parsed * 1e3, cached * 1e3, loaded * 1e3))
+    finally:
+        for name in os.listdir(tmpdir):
+            os.unlink(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+def bench_http():
+    '''Polling a configuration served over HTTP: full GETs on new connections parsed with parse_config(), versus reload_url().'''
+
+    import threading, urllib.request
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'bench.conf')
+    downloaded = os.path.join(tmpdir, 'downloaded.conf')
+
+    class Handler(SimpleHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def __init__(self, *args, **kwargs):
+            SimpleHTTPRequestHandler.__init__(self, *args, directory=tmpdir, **kwargs)
+
+        def send_head(self):
+            # SimpleHTTPRequestHandler only checks If-Modified-Since: answer If-None-Match as well
+            if self.headers.get('If-None-Match') == self.etag():
+                self.send_response(304)
+                self.end_headers()
+                return None
+            return SimpleHTTPRequestHandler.send_head(self)
+
+        def end_headers(self):
+            self.send_header('ETag', self.etag())
+            SimpleHTTPRequestHandler.end_headers(self)
+
+        def etag(self):
+            return '"{0}"'.format(os.stat(filename).st_mtime_ns)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:{0}/bench.conf'.format(server.server_port)
+
+    try:
+        for count in (100, 1000, 10000):
+            _write_config(filename, count)
+            scope = OptionsMeta(lambda s: None)
+            _define_config_options(scope.define_opt, count)
+
+            def full_get():
+                with urllib.request.urlopen(url) as response, open(downloaded, 'wb') as fp:
+                    fp.write(response.read())
+                scope.reload_config(downloaded)
+
+            scope.parse_url(url)
+            print('poll {0:>6} options: full GET + reload_config {1:8.2f} us, reload_url {2:8.2f} us'.format(count, _timeit(full_get, 20), _timeit(lambda: scope.reload_url(url), 200)))
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        for name in os.listdir(tmpdir):
+            os.unlink(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+def bench_validate():
+    '''Validating a corpus of 10000 configuration files: a parse_config() loop versus validate_files() on 1 and on all CPUs.'''
+
+    tmpdir = tempfile.mkdtemp()
+    configs = os.path.join(tmpdir, 'conf.d')
+    os.mkdir(configs)
+
+    with open(os.path.join(tmpdir, 'groper_bench_schema.py'), 'w') as fp:
+        fp.write('from groper import OptionsMeta\n')
+        fp.write('from benchmarks import _define_config_options\n')
+        fp.write('scope = OptionsMeta(lambda s: None)\n')
+        fp.write('_define_config_options(scope.define_opt, 100)\n')
+
+    files = []
+    for i in range(10000):
+        files.append(os.path.join(configs, 'host{0:05}.conf'.format(i)))
+        _write_config(files[-1], 100)
+
+    def parse_loop():
+        for filename in files:
+            scope = OptionsMeta(lambda s: None)
+            _define_config_options(scope.define_opt, 100)
+            try:
+                scope.parse_config(filename)
+            except Exception:
+                pass
+
+    def timed(func, *args):
+        start = timeit.default_timer()
+        func(*args)
+        return timeit.default_timer() - start
+
+    sys.path.insert(0, tmpdir)
+    try:
+        print('validate 10000 files, {0} CPUs: parse_config loop {1:6.2f} s, validate_files 1 process {2:6.2f} s, all CPUs {3:6.2f} s'.format(
+            os.cpu_count(),
+            timed(parse_loop),
+            timed(validate_files, 'groper_bench_schema:scope', [configs], 1),
+            timed(validate_files, 'groper_bench_schema:scope', [configs]),
+        ))
+    finally:
+        sys.path.remove(tmpdir)
+        for dirpath, dirnames, filenames in os.walk(tmpdir, topdown=False):
+            for name in filenames:
+                os.unlink(os.path.join(dirpath, name))
+            for name in dirnames:
+                os.rmdir(os.path.join(dirpath, name))
+        os.rmdir(tmpdir)
+
+def bench_interpolation():
+    '''reload_config() of a config with 10000 interpolated options, when nothing they reference changed versus when a shared base changed.'''
+
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+
+    def write(base, other):
+        with open(filename, 'w') as fp:
+            fp.write('[paths]\nbase = {0}\nother = {1}\n'.format(base, other))
+            for section in range(100):
+                fp.write('[section{0}]\n'.format(section))
+                for i in range(100):
+                    fp.write('opt{0} = ${{paths.base}}/{1}/{0}\n'.format(i, section))
+
+    scope = OptionsMeta(lambda s: None)
+    scope.define_opt('paths', 'base')
+    scope.define_opt('paths', 'other')
+    for section in range(100):
+        for i in range(100):
+            scope.define_opt('section{0}'.format(section), 'opt{0}'.format(i), interpolate=True)
+
+    try:
+        write('/srv', 0)
+        scope.init_options([], config_file=filename)
+
+        def reload(base, other):
+            write(base, other)
+            start = timeit.default_timer()
+            changes = scope.reload_config(filename)
+            return timeit.default_timer() - start, len(changes)
+
+        unrelated = min(reload('/srv', i) for i in range(1, 6))
+        base = min(reload('/srv{0}'.format(i), 0) for i in range(1, 6))
+        print('reload_config, 10000 interpolated options: unrelated change {0:8.2f} ms ({1} changes), base changed {2:8.2f} ms ({3} changes)'.format(unrelated[0] * 1e3, unrelated[1], base[0] * 1e3, base[1]))
+    finally:
+        os.unlink(filename)
+
+def bench_response_files():
+    '''parse_args() and verify_all_options() with 100000 file arguments, on the command line versus in a streamed response file.'''
+
+    files = ['/data/input/part-{0:06}.csv'.format(i) for i in range(100000)]
+    fd, listing = tempfile.mkstemp()
+    with os.fdopen(fd, 'w') as fp:
+        fp.writelines(filename + '\n' for filename in files)
+
+    def measure(response_files, argv):
+        scope = OptionsMeta(lambda s: None)
+        scope.define_args((-2, 'file'), response_files=response_files)
+
+        tracemalloc.start()
+        start = timeit.default_timer()
+        scope.parse_args(argv)
+        scope.verify_all_options()
+        elapsed = timeit.default_timer() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed, peak
+
+    try:
+        for name, response_files, argv in (('argv', False, files), ('response file', True, ['@' + listing])):
+            elapsed, peak = measure(response_files, argv)
+            print('parse_args + verify, 100000 arguments in {0:13}: {1:8.2f} ms, peak {2:8.2f} MB'.format(name, elapsed * 1e3, peak / 1e6))
+    finally:
+        os.unlink(listing)
+
+def bench_namespaces():
+    '''Creation time and memory of 10000 tenant namespaces of a 50 option schema, versus an options object per tenant.'''
+
+    count = 10000
+    table = [('section{0}'.format(i % 5), 'opt{0}'.format(i), {'type': int, 'default': i}) for i in range(50)]
+    values = [{'section0': {'opt0': str(tenant)}} for tenant in range(count)]
+
+    def per_tenant_scopes(tenants):
+        scopes = []
+        for tenant_values in tenants:
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opts(table)
+            for section, section_values in tenant_values.items():
+                for name, value in section_values.items():
+                    setattr(getattr(scope.options, section), name, int(value))
+            scope.set_defaults()
+            scopes.append(scope)
+        return scopes
+
+    def namespaces(tenants):
+        scope = OptionsMeta(lambda s: None)
+        scope.define_opts(table)
+        return [scope.new_namespace(values=tenant_values) for tenant_values in tenants]
+
+    # Options objects per tenant are measured on a tenth of the tenants
+    for name, create, tenants in (('options object per tenant', per_tenant_scopes, values[:count // 10]), ('new_namespace', namespaces, values)):
+        start = timeit.default_timer()
+        create(tenants)
+        elapsed = timeit.default_timer() - start
+
+        tracemalloc.start()
+        created = create(tenants)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del created
+
+        print('{0:>6} tenants, {1:25}: {2:8.2f} us/tenant, {3:8.0f} B/tenant'.format(count, name, elapsed * 1e6 / len(tenants), size / len(tenants)))
+
+# Types of the synthetic schemas, with a value in INI syntax and the source code to define them
+_SCHEMA_TYPES = (
+    (int, '42', 'int'),
+    (float, '1.5', 'float'),
+    (bool, 'yes', 'bool'),
+    (str, 'some value', 'str'),
+    (ListOf(int), '1, 2, 5-8', 'ListOf(int)'),
+    (duration, '5m', 'duration'),
+)
+_SCHEMA_DEFAULTS = {int: 0, float: 0.0, str: '', duration: 60.0}
+
+def generate_schema(count, seed=0):
+    '''Returns the define_opts() specs of a reproducible schema of count options.
+
+    Options have varied types and are spread over about sqrt(count) sections.
+    One in ten options has a cmd_name, and two in three have a default.
+    '''
+
+    rnd = random.Random(seed)
+    sections = max(1, int(count ** 0.5))
+
+    specs = []
+    for i in range(count):
+        type, value, source = _SCHEMA_TYPES[rnd.randrange(len(_SCHEMA_TYPES))]
+        kwargs = {'type': type}
+        if i % 10 == 0:
+            kwargs['cmd_name'] = 'opt-{0}'.format(i)
+        if i % 3 and type in _SCHEMA_DEFAULTS:
+            kwargs['default'] = _SCHEMA_DEFAULTS[type]
+        specs.append(('section{0}'.format(i % sections), 'opt{0}'.format(i), kwargs))
+
+    return specs
+
+def _schema_value(type):
+    for schema_type, value, source in _SCHEMA_TYPES:
+        if schema_type == type:
+            return value
+
+def generate_argv(specs):
+    '''Returns a command line setting every option of specs that has a cmd_name.'''
+
+    argv = []
+    for section, name, kwargs in specs:
+        if 'cmd_name' not in kwargs:
+            continue
+
+        if kwargs['type'] is bool:
+            argv.append('--{0}'.format(kwargs['cmd_name']))
+        else:
+            argv.append('--{0}={1}'.format(kwargs['cmd_name'], _schema_value(kwargs['type'])))
+
+    return argv + ['file1', 'file2']
+
+def write_ini(specs, filename):
+    '''Writes a configuration file setting the options of specs that are required, and every other optional one.'''
+
+    sections = {}
+    for i, (section, name, kwargs) in enumerate(specs):
+        if 'default' not in kwargs or i % 2:
+            sections.setdefault(section, []).append('{0} = {1}\n'.format(name, _schema_value(kwargs['type'])))
+
+    with open(filename, 'w') as fp:
+        for section, lines in sections.items():
+            fp.write('[{0}]\n'.format(section))
+            fp.writelines(lines)
+
+def write_schema_module(specs, filename):
+    '''Writes a Python module defining the options of specs with define_opt(), the way applications do.'''
+
+    sources = dict((repr(type), source) for type, value, source in _SCHEMA_TYPES)
+    with open(filename, 'w') as fp:
+        fp.write('from groper import define_opt, ListOf, duration\n\n')
+        for section, name, kwargs in specs:
+            args = ''.join(', {0}={1}'.format(key, sources[repr(value)] if key == 'type' else repr(value)) for key, value in sorted(kwargs.items()))
+            fp.write('define_opt({0!r}, {1!r}{2})\n'.format(section, name, args))
+
+def _best(func, repeat):
+    '''Returns the best wall time of func() over repeat runs, calling setup() before each when func is a (setup, func) pair.'''
+
+    times = []
+    for _ in range(repeat):
+        args = func[0]() if isinstance(func, tuple) else ()
+        start = timeit.default_timer()
+        (func[1] if isinstance(func, tuple) else func)(*args)
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+def run_suite(sizes, repeat=3):
+    '''Times every phase of groper on synthetic schemas of each size.
+
+    Returns a dict mapping metric names, such as parse_config/1000, to their best
+    time in seconds.
+    '''
+
+    results = {}
+    tmpdir = tempfile.mkdtemp()
+    python = [sys.executable, '-X', 'frozen_modules=on'] if sys.version_info >= (3, 11) else [sys.executable]
+
+    try:
+        results['python_startup'] = _best(lambda: subprocess.check_call(python + ['-c', 'pass']), repeat)
+
+        for size in sizes:
+            specs = generate_schema(size)
+            argv = generate_argv(specs)
+            ini = os.path.join(tmpdir, 'bench{0}.conf'.format(size))
+            write_ini(specs, ini)
+
+            def defined():
+                scope = OptionsMeta(lambda s: None)
+                for section, name, kwargs in specs:
+                    scope.define_opt(section, name, **kwargs)
+                return scope,
+
+            def configured():
+                scope, = defined()
+                scope.parse_args(argv)
+                scope.parse_config(ini)
+                return scope,
+
+            def defaulted():
+                scope, = configured()
+                scope.set_defaults()
+                return scope,
+
+            phases = (
+                ('define_opt', (lambda: (), defined)),
+                ('define_opts', lambda: OptionsMeta(lambda s: None).define_opts(specs)),
+                ('parse_args', (defined, lambda scope: scope.parse_args(argv))),
+                ('parse_config', (defined, lambda scope: scope.parse_config(ini))),
+                ('parse_config_streaming', (defined, lambda scope: scope.parse_config(ini, streaming=True))),
+                ('set_defaults', (configured, lambda scope: scope.set_defaults())),
+                ('verify_all_options', (defaulted, lambda scope: scope.verify_all_options())),
+                ('usage', (defined, lambda scope: scope.usage('prog'))),
+                ('generate_sample_config', (defined, lambda scope: scope.generate_sample_config())),
+                ('init_options', (defined, lambda scope: scope.init_options(argv, config_file=ini))),
+            )
+            for phase, func in phases:
+                results['{0}/{1}'.format(phase, size)] = _best(func, repeat)
+
+            # Cold start: a new interpreter imports groper and a schema module, then calls init_options()
+            module = 'bench_schema{0}'.format(size)
+            write_schema_module(specs, os.path.join(tmpdir, module + '.py'))
+            code = 'import sys; sys.path[:0] = [{0!r}, {1!r}]; import {2}; from groper import init_options; init_options(config_file={3!r})'.format(tmpdir, os.path.dirname(os.path.abspath(groper.__file__)), module, ini)
+            subprocess.check_call(python + ['-c', code] + argv) # Compiles the schema module
+            results['init_options_cold/{0}'.format(size)] = _best(lambda: subprocess.check_call(python + ['-c', code] + argv), repeat)
+    finally:
+        for dirpath, dirnames, filenames in os.walk(tmpdir, topdown=False):
+            for name in filenames:
+                os.unlink(os.path.join(dirpath, name))
+            for name in dirnames:
+                os.rmdir(os.path.join(dirpath, name))
+        os.rmdir(tmpdir)
+
+    return results
+
+# Differences below this many seconds are timer noise rather than regressions
+_MIN_REGRESSION = 50e-6
+
+def compare_results(baseline, results, threshold):
+    '''Returns the (metric, baseline seconds, seconds, ratio) of the metrics that got slower than threshold times the baseline.'''
+
+    regressions = []
+    for metric, seconds in sorted(results.items()):
+        before = baseline.get(metric)
+        if before is None or seconds - before < _MIN_REGRESSION:
+            continue
+
+        ratio = seconds / before if before else float('inf')
+        if ratio > threshold:
+            regressions.append((metric, before, seconds, ratio))
+
+    return regressions
+
+def bench_suite(sizes=(10, 100, 1000, 10000, 100000), repeat=3, json_file=None, compare=None, threshold=1.25):
+    '''Every phase at every schema size, see run_suite(). Returns False if a regression was found.'''
+
+    results = run_suite(sizes, repeat)
+    for metric, seconds in sorted(results.items()):
+        print('{0:40} {1:12.3f} ms'.format(metric, seconds * 1e3))
+
+    if json_file:
+        with open(json_file, 'w') as fp:
+            json.dump({
+                'groper': groper.__version__,
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'results': results,
+            }, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+
+    if compare:
+        with open(compare) as fp:
+            baseline = json.load(fp)['results']
+
+        regressions = compare_results(baseline, results, threshold)
+        for metric, before, seconds, ratio in regressions:
+            print('REGRESSION {0}: {1:.3f} ms -> {2:.3f} ms ({3:.2f}x)'.format(metric, before * 1e3, seconds * 1e3, ratio))
+        print('{0} of {1} metrics regressed by more than {2:.2f}x.'.format(len(regressions), len(results), threshold))
+        return not regressions
+
+    return True
+
+
+BENCHMARKS = {
+    'parse_args': bench_parse_args,
+    'config_cache': bench_config_cache,
+    'streaming_config': bench_streaming_config,
+    'lazy_init': bench_lazy_init,
+    'schema_memory': bench_schema_memory,
+    'define_opts': bench_define_opts,
+    'usage': bench_usage,
+    'commands': bench_commands,
+    'verify': bench_verify,
+    'converters': bench_converters,
+    'compiled': bench_compiled,
+    'validate': bench_validate,
+    'http': bench_http,
+    'interpolation': bench_interpolation,
+    'response_files': bench_response_files,
+    'namespaces': bench_namespaces,
+    'suite': bench_suite,
+}
+
+def main(argv):
+    cli = OptionsMeta()
+    cli.define_opt('main', 'help', type=bool, cmd_name='help', cmd_short_name='h', is_help=True)
+    cli.define_opt('suite', 'sizes', type=ListOf(int), cmd_name='sizes', default=[10, 100, 1000, 10000, 100000])
+    cli.define_opt('suite', 'repeat', type=int, cmd_name='repeat', default=3)
+    cli.define_opt('suite', 'json', cmd_name='json', default=None)
+    cli.define_opt('suite', 'compare', cmd_name='compare', default=None)
+    cli.define_opt('suite', 'threshold', type=float, cmd_name='threshold', default=1.25)
+    cli.define_args((-1, 'benchmark'))
+    cli.init_options(argv)
+
+    ok = True
+    for name in cli.cmdargs or BENCHMARKS:
+        if name == 'suite':
+            suite = cli.options.suite
+            ok = bench_suite(suite.sizes, suite.repeat, suite.json, suite.compare, suite.threshold)
+        else:
+            BENCHMARKS[name]()
+
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
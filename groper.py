@@ -1,16 +1,961 @@
 
-from configparser import RawConfigParser, NoOptionError
 from io import StringIO
 
-import getopt, os.path, sys, re, codecs
+# Only modules that are cheap to import, or already imported at interpreter
+# startup: the others are imported by the functions that need them
+import os.path, sys, codecs, time, struct, marshal, _thread
+
+_type = type
 
 class OptionObject(object):
     def __init__(self, **kwargs):
         for key, val in kwargs.items():
             setattr(self, key, val)
 
+class _NoDefault(object):
+    def __repr__(self):
+        return 'NO_DEFAULT'
+
+NO_DEFAULT = _NoDefault() # The default of options that do not have one
+
+class OptionDefinition(object):
+    '''The definition of an option, as stored by define_opt().
+
+    set_by and source record which function and which configuration file set
+    the option's value. command is the command whose loader defined the option,
+    or None for global options.
+    '''
+
+    __slots__ = ('section', 'name', 'cmd_name', 'cmd_short_name', 'type', 'is_config_file', 'is_help', 'cmd_group', 'cmd_only', 'default', 'required', 'set_by', 'source', 'command', 'interpolate')
+
+    def __init__(self, section, name, cmd_name, cmd_short_name, type, is_config_file, is_help, cmd_group, cmd_only, default=NO_DEFAULT, interpolate=False):
+        self.section = section
+        self.name = name
+        self.cmd_name = cmd_name
+        self.cmd_short_name = cmd_short_name
+        self.type = type
+        self.is_config_file = is_config_file
+        self.is_help = is_help
+        self.cmd_group = cmd_group
+        self.cmd_only = cmd_only
+        self.default = default
+        self.required = default is NO_DEFAULT
+        self.interpolate = interpolate
+        self.set_by = None
+        self.source = None
+        self.command = None
+
 class OptionsError(Exception): pass
-class OptionsUserError(Exception): pass
+class OptionsUserError(Exception):
+    '''An error in the options given by the user. errors lists each individual problem.'''
+
+    def __init__(self, message, errors=None):
+        Exception.__init__(self, message)
+        self.errors = list(errors) if errors is not None else [str(message)]
+
+    def __reduce__(self):
+        return (_type(self), (str(self), self.errors))
+
+class OptionsScope(tuple):
+    '''The value returned by OptionsMeta().
+
+    Unpacks exactly like the classic tuple of options, cmdargs and the options
+    manipulation functions, but also exposes every function of the scope as an
+    attribute, including those that are not part of the tuple.
+    '''
+
+    def __new__(cls, values, **extras):
+        scope = tuple.__new__(cls, values)
+        scope.__dict__.update(extras)
+        return scope
+
+class OptionsSnapshot(object):
+    '''An immutable view of option values.
+
+    Values are read with the same snapshot.section.name syntax as the options
+    object. Each distinct layout of names gets its own class with __slots__, so
+    attribute access does not go through a per-instance dict.
+    '''
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{0} is read-only.'.format(_type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError('{0} is read-only.'.format(_type(self).__name__))
+
+    def __repr__(self):
+        return '{0}({1})'.format(_type(self).__name__, ', '.join('{0}={1!r}'.format(name, getattr(self, name)) for name in self.__slots__ if hasattr(self, name)))
+
+_snapshot_classes = {}
+
+_LOWERCASE = 'abcdefghijklmnopqrstuvwxyz'
+_DIGITS = '0123456789'
+
+def _is_name(value, first_chars, chars):
+    '''Returns True if value starts with one of first_chars and only contains chars.
+
+    Names are not checked with regular expressions, so that defining options
+    does not import re.
+    '''
+
+    return value != '' and value[0] in first_chars and not value.strip(chars)
+
+_regexes = {}
+
+def _regex(pattern):
+    '''Returns pattern compiled, importing re on first use.'''
+
+    compiled = _regexes.get(pattern)
+    if compiled is None:
+        import re
+        compiled = _regexes.setdefault(pattern, re.compile(pattern))
+    return compiled
+
+def _snapshot_class(names):
+    '''Returns the OptionsSnapshot subclass with a slot for each of names, a tuple.'''
+
+    cls = _snapshot_classes.get(names)
+    if cls is None:
+        cls = _snapshot_classes.setdefault(names, _type('OptionsSnapshot', (OptionsSnapshot,), {'__slots__': names}))
+    return cls
+
+def _make_snapshot(items):
+    '''Creates an OptionsSnapshot from a list of (name, value) pairs.'''
+
+    cls = _snapshot_class(tuple(name for name, _ in items))
+    snapshot = object.__new__(cls)
+    for name, value in items:
+        object.__setattr__(snapshot, name, value)
+    return snapshot
+
+class _Template(object):
+    '''The raw value of an option defined with interpolate=True, until references in it are replaced.'''
+
+    __slots__ = ('raw',)
+
+    def __init__(self, raw):
+        self.raw = raw
+
+_REFERENCE = r'\$(?:\$|\{([^}]*)\})'
+
+def _parse_template(raw, section):
+    '''Splits a value into literal strings and (section, name) references.
+
+    ${section.name} refers to an option of any section, ${name} to an option of
+    the same section, and $$ is a literal $.
+    '''
+
+    parts = []
+    pos = 0
+    for mo in _regex(_REFERENCE).finditer(raw):
+        parts.append(raw[pos:mo.start()])
+        if mo.group(1) is None:
+            parts.append('$')
+        else:
+            ref_section, _, ref_name = mo.group(1).strip().lower().rpartition('.')
+            parts.append((ref_section or section, ref_name))
+        pos = mo.end()
+    parts.append(raw[pos:])
+
+    return [part for part in parts if part]
+
+class _StreamedConfig(object):
+    '''The subset of a configuration file read by _read_config_stream().
+
+    Provides the read-only part of the RawConfigParser interface used by groper.
+    '''
+
+    default_section = 'DEFAULT'
+
+    def __init__(self, sections, defaults):
+        self._sections = sections
+        self._defaults = defaults
+
+    def has_section(self, section):
+        return section in self._sections
+
+    def has_option(self, section, option):
+        if not section or section == self.default_section:
+            return option.lower() in self._defaults
+        elif section not in self._sections:
+            return False
+
+        option = option.lower()
+        return option in self._sections[section] or option in self._defaults
+
+    def get(self, section, option):
+        if section != self.default_section and section not in self._sections:
+            from configparser import NoSectionError
+            raise NoSectionError(section)
+
+        option = option.lower()
+        values = self._sections.get(section, self._defaults)
+        if option in values:
+            return values[option]
+        if option in self._defaults:
+            return self._defaults[option]
+        from configparser import NoOptionError
+        raise NoOptionError(option, section)
+
+# The booleans of RawConfigParser.getboolean()
+_BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True, '0': False, 'no': False, 'false': False, 'off': False}
+
+def _to_boolean(value):
+    if value.lower() not in _BOOLEAN_STATES:
+        raise ValueError('Not a boolean: {0}'.format(value))
+    return _BOOLEAN_STATES[value.lower()]
+
+_DURATION_UNITS = {'ns': 1e-9, 'us': 1e-6, 'ms': 1e-3, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+_DURATION_PART = r'\s*(\d+(?:\.\d*)?|\.\d+)\s*([a-z]*)'
+
+def duration(value):
+    '''An option type for durations such as 30s, 5m, 1h30m or 250ms, converted to seconds as a float.
+
+    A number without a unit is a number of seconds.
+    '''
+
+    text = value.strip().lower()
+    if not text:
+        raise ValueError('Not a duration: {0!r}'.format(value))
+
+    seconds = 0
+    pos = 0
+    while pos < len(text):
+        mo = _regex(_DURATION_PART).match(text, pos)
+        if not mo or mo.group(2) not in _DURATION_UNITS and (mo.group(2) or mo.end() != len(text)):
+            raise ValueError('Not a duration: {0!r}'.format(value))
+
+        seconds += float(mo.group(1)) * _DURATION_UNITS.get(mo.group(2), 1)
+        pos = mo.end()
+
+    return seconds
+
+_SIZE_UNITS = {'': 1, 'b': 1}
+for _i, _prefix in enumerate('kmgtpe', start=1):
+    _SIZE_UNITS[_prefix] = _SIZE_UNITS[_prefix + 'b'] = 1000 ** _i
+    _SIZE_UNITS[_prefix + 'ib'] = 1024 ** _i
+del _i, _prefix
+
+_SIZE = r'(?i)\s*(\d+(?:\.\d*)?|\.\d+)\s*([a-z]*)\s*$'
+
+def byte_size(value):
+    '''An option type for sizes such as 512MiB, 1.5GB or 64k, converted to a number of bytes.
+
+    Decimal units (kB, MB, ...) are powers of 1000, binary units (KiB, MiB, ...)
+    powers of 1024. A number without a unit is a number of bytes.
+    '''
+
+    mo = _regex(_SIZE).match(value)
+    if not mo or mo.group(2).lower() not in _SIZE_UNITS:
+        raise ValueError('Not a size: {0!r}'.format(value))
+
+    number, unit = mo.group(1), _SIZE_UNITS[mo.group(2).lower()]
+    if '.' in number:
+        return int(round(float(number) * unit))
+    return int(number) * unit
+
+def _parse_ints(items, values):
+    '''Appends ints and inclusive ranges of ints, such as 8000-8010, to values.'''
+
+    try:
+        values.extend([int(item) for item in items])
+        return values
+    except ValueError:
+        pass
+
+    del values[:]
+    for item in items:
+        sep = item.find('-', 1)
+        if sep == -1:
+            values.append(int(item))
+            continue
+
+        start, end = int(item[:sep]), int(item[sep + 1:])
+        if end < start:
+            raise ValueError('Invalid range: {0}'.format(item))
+        values.extend(range(start, end + 1))
+
+    return values
+
+def _array(typecode, values=()):
+    '''Creates an array.array, importing array on first use and registering how to copy arrays.'''
+
+    import array
+    _copy_value[array.array] = array.array.__copy__
+    return array.array(typecode, values)
+
+class ListOf(object):
+    '''An option type for lists such as 1, 2, 5, e.g. type=ListOf(int).
+
+    Items are separated by separator or new lines, or by whitespace if separator
+    is None, and converted with item_type, which may be any option type. Lists of
+    ints may contain inclusive ranges such as 8000-8010. Lists of ints and floats
+    are stored compactly in an array.array.
+    '''
+
+    container = list
+
+    def __init__(self, item_type=str, separator=','):
+        self.item_type = item_type
+        self.separator = separator
+        self.__name__ = '{0} of {1}'.format(self.container.__name__, getattr(item_type, '__name__', item_type))
+
+    def __eq__(self, other):
+        return _type(self) is _type(other) and (self.item_type, self.separator) == (other.item_type, other.separator)
+
+    def __hash__(self):
+        return hash((_type(self), self.item_type, self.separator))
+
+    def __repr__(self):
+        return '{0}({1}, {2!r})'.format(_type(self).__name__, getattr(self.item_type, '__qualname__', self.item_type), self.separator)
+
+    def _items(self, value):
+        if self.separator is None:
+            return value.split()
+        return [item for item in map(str.strip, value.replace('\n', self.separator).split(self.separator)) if item]
+
+    def __call__(self, value):
+        return self.convert(value, _converters)
+
+    def convert(self, value, converters):
+        '''Converts value, converting items with converters, the registry of an OptionsMeta scope.'''
+
+        items = self._items(value)
+
+        if self.item_type not in converters:
+            if self.item_type is int:
+                try:
+                    return _parse_ints(items, _array('q'))
+                except OverflowError:
+                    return _parse_ints(items, [])
+            if self.item_type is float:
+                return _array('d', [float(item) for item in items])
+
+        convert = converters.get(self.item_type, self.item_type)
+        if isinstance(convert, ListOf):
+            return [convert.convert(item, converters) for item in items]
+        return [convert(item) for item in items]
+
+    def to_string(self, value):
+        '''Formats a value the way it is written in a configuration file.'''
+
+        if value is None:
+            return str(value)
+        return ('{0} '.format(self.separator) if self.separator else ' ').join(str(item) for item in value)
+
+class SetOf(ListOf):
+    '''An option type for sets, with the syntax of ListOf.'''
+
+    container = set
+
+    def convert(self, value, converters):
+        return set(ListOf.convert(self, value, converters))
+
+    def to_string(self, value):
+        return ListOf.to_string(self, sorted(value) if value is not None else value)
+
+# Conversions of raw strings for the types that cannot simply be called on them.
+# Each OptionsMeta scope starts with a copy, see register_converter().
+_converters = {
+    bool: _to_boolean,
+    list: ListOf(),
+    set: SetOf(),
+}
+
+# Conversion results that can be memoized as they are, or copied on each use
+_immutable_types = frozenset((bool, int, float, complex, str, bytes, tuple, frozenset, _type(None)))
+_copy_value = {
+    list: list.copy,
+    set: set.copy,
+}
+_CONVERSION_CACHE_SIZE = 65536
+
+def _read_config_stream(fp, source, wanted):
+    '''Reads an INI file line by line, keeping only the wanted options.
+
+    wanted maps section names to sets of option names. Other sections are
+    skipped without storing anything but their names, which are needed to detect
+    duplicate sections. The syntax and errors are those of RawConfigParser with
+    its default settings, except that duplicate options are only detected among
+    the wanted ones.
+
+    Returns a _StreamedConfig.
+    '''
+
+    from configparser import RawConfigParser, ParsingError, MissingSectionHeaderError, DuplicateSectionError, DuplicateOptionError
+
+    sections = {}
+    defaults = {}
+    all_wanted = set().union(*wanted.values()) if wanted else set()
+    default_section = _StreamedConfig.default_section
+
+    seen_sections = set()
+    seen_options = set()
+    errors = None
+
+    sectname = None     # Current section, None before the first section header
+    values = None       # Where to store the current section's wanted options, None if skipped
+    names = None        # Wanted option names of the current section
+    optname = None      # Current option, whose value may continue on the next lines
+    optlines = None     # Value lines of the current option, None if it is not wanted
+    indent_level = 0
+
+    for lineno, line in enumerate(fp, start=1):
+        value = line.strip()
+
+        if not value:
+            if optlines is not None:
+                optlines.append('')
+            continue
+
+        if value[0] in '#;':
+            continue
+
+        cur_indent_level = len(line) - len(line.lstrip())
+        if optname is not None and cur_indent_level > indent_level:
+            if optlines is not None:
+                optlines.append(value)
+            continue
+
+        indent_level = cur_indent_level
+
+        if optlines is not None:
+            values[optname] = '\n'.join(optlines).rstrip()
+            optlines = None
+
+        mo = RawConfigParser.SECTCRE.match(value) if value[0] == '[' else None
+        if mo:
+            sectname = mo.group('header')
+            optname = None
+
+            if sectname == default_section:
+                values, names = defaults, all_wanted
+                continue
+
+            if sectname in seen_sections:
+                raise DuplicateSectionError(sectname, source, lineno)
+            seen_sections.add(sectname)
+
+            if sectname in wanted:
+                values, names = sections.setdefault(sectname, {}), wanted[sectname]
+            else:
+                values, names = None, None
+            continue
+
+        if sectname is None:
+            raise MissingSectionHeaderError(source, lineno, line)
+
+        if values is None:
+            # Skipped section: only check that this is a valid option line
+            if value[0] in '=:' or ('=' not in value and ':' not in value):
+                errors = errors or ParsingError(source)
+                errors.append(lineno, repr(line))
+            else:
+                optname = ''
+            continue
+
+        mo = RawConfigParser.OPTCRE.match(value)
+        if not mo or not mo.group('option'):
+            errors = errors or ParsingError(source)
+            errors.append(lineno, repr(line))
+            if not mo:
+                continue
+
+        optname = mo.group('option').rstrip().lower()
+        if optname in names:
+            if (sectname, optname) in seen_options:
+                raise DuplicateOptionError(sectname, optname, source, lineno)
+            seen_options.add((sectname, optname))
+            optlines = [mo.group('value').strip()]
+
+    if optlines is not None:
+        values[optname] = '\n'.join(optlines).rstrip()
+
+    if errors:
+        raise errors
+
+    return _StreamedConfig(sections, defaults)
+
+class InitStats(object):
+    '''Timing and provenance information collected by init_options(stats=True).
+
+    phases maps each phase that ran (parse_args, parse_env, parse_config,
+    parse_configs, load_compiled, set_defaults, verify_all_options) to its wall
+    time in seconds. files_read
+    lists the (path, size in bytes) of every configuration file read. sources
+    maps each (section, name) to where its value came from: 'argv', 'env', the
+    path of a configuration file, 'default', or None if it was not set.
+    '''
+
+    def __init__(self):
+        self.phases = {}
+        self.files_read = []
+        self.sources = {}
+
+    @property
+    def total_time(self):
+        return sum(self.phases.values())
+
+    @property
+    def bytes_read(self):
+        return sum(size for _, size in self.files_read)
+
+    @property
+    def counts(self):
+        '''Returns the number of options set from each kind of source: argv, env, config, default and unset.'''
+
+        counts = {'argv': 0, 'env': 0, 'config': 0, 'default': 0, 'unset': 0}
+        for source in self.sources.values():
+            if source is None:
+                counts['unset'] += 1
+            elif source in counts:
+                counts[source] += 1
+            else:
+                counts['config'] += 1
+        return counts
+
+def _attach_shared_memory(name):
+    '''Attaches to an existing shared memory segment without registering it with the resource tracker.
+
+    Before Python 3.13, attaching registers the segment as if this process had
+    created it, and the resource tracker then unlinks it when the process exits.
+    '''
+
+    from multiprocessing import shared_memory, resource_tracker
+
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+
+    with _shared_memory_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            resource_tracker.register = register
+
+_shared_memory_lock = _thread.allocate_lock()
+
+# Shared options segment layout: header, marshalled index, then the values
+_SHARED_MAGIC = b'GRPR'
+_SHARED_HEADER = struct.Struct('<4sHHQ40sI') # magic, format, reserved, generation, schema fingerprint, index size
+_SHARED_GENERATION = struct.Struct('<Q')
+_SHARED_INT = struct.Struct('<q')
+_SHARED_FLOAT = struct.Struct('<d')
+_SHARED_NONE, _SHARED_BOOL, _SHARED_INT_CODE, _SHARED_FLOAT_CODE, _SHARED_STR, _SHARED_BYTES, _SHARED_PICKLE = range(7)
+
+# Compiled options file layout: magic, then a marshalled (format, interpreter
+# cache tag, schema fingerprint, values, templates) tuple
+_COMPILED_MAGIC = b'GRPC'
+_COMPILED_FORMAT = 2
+_marshal_scalars = frozenset((bool, int, float, complex, str, bytes, _type(None)))
+_marshal_containers = frozenset((tuple, list, set, frozenset))
+
+def _marshallable(value):
+    '''Returns True if marshal stores value as it is. It would store other bytes-like objects, e.g. arrays, as bytes.'''
+
+    if _type(value) in _marshal_scalars:
+        return True
+    if _type(value) in _marshal_containers:
+        return all(_marshallable(item) for item in value)
+    if _type(value) is dict:
+        return all(_marshallable(k) and _marshallable(v) for k, v in value.items())
+    return False
+
+def _encode_shared_value(value):
+    '''Returns the (type code, bytes) pair a value is stored as in a shared options segment.'''
+
+    if value is None:
+        return _SHARED_NONE, b''
+    if _type(value) is bool:
+        return _SHARED_BOOL, b'\x01' if value else b'\x00'
+    if _type(value) is int and -2 ** 63 <= value < 2 ** 63:
+        return _SHARED_INT_CODE, _SHARED_INT.pack(value)
+    if _type(value) is float:
+        return _SHARED_FLOAT_CODE, _SHARED_FLOAT.pack(value)
+    if _type(value) is str:
+        return _SHARED_STR, value.encode('utf-8', 'surrogatepass')
+    if _type(value) is bytes:
+        return _SHARED_BYTES, value
+
+    import pickle
+    return _SHARED_PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+def _decode_shared_value(buf, code, offset, length):
+    if code == _SHARED_NONE:
+        return None
+    if code == _SHARED_BOOL:
+        return buf[offset] == 1
+    if code == _SHARED_INT_CODE:
+        return _SHARED_INT.unpack_from(buf, offset)[0]
+    if code == _SHARED_FLOAT_CODE:
+        return _SHARED_FLOAT.unpack_from(buf, offset)[0]
+    if code == _SHARED_STR:
+        return str(buf[offset:offset + length], 'utf-8', 'surrogatepass')
+    if code == _SHARED_BYTES:
+        return bytes(buf[offset:offset + length])
+
+    import pickle
+    return pickle.loads(buf[offset:offset + length])
+
+def _pack_shared_options(sections, generation, fingerprint):
+    '''Packs a list of (section, [(name, value), ...]) into the shared options segment layout.'''
+
+    index = []
+    values = []
+    offset = 0
+    for section, items in sections:
+        entries = []
+        for name, value in items:
+            code, data = _encode_shared_value(value)
+            entries.append((name, code, offset, len(data)))
+            values.append(data)
+            offset += len(data)
+        index.append((section, entries))
+
+    index = marshal.dumps(index)
+    header = _SHARED_HEADER.pack(_SHARED_MAGIC, 1, 0, generation, fingerprint.encode('ascii'), len(index))
+    return b''.join([header, index] + values)
+
+class SharedOptionsSection(object):
+    '''A read-only section of SharedOptions. Values are decoded from shared memory on every access.'''
+
+    def __init__(self, shm, base, entries):
+        object.__setattr__(self, '_shm', shm) # Keeps the segment mapped while this section is in use
+        object.__setattr__(self, '_base', base)
+        object.__setattr__(self, '_entries', entries)
+
+    def __getattr__(self, name):
+        try:
+            code, offset, length = self._entries[name]
+        except KeyError:
+            raise AttributeError(name)
+        return _decode_shared_value(self._shm.buf, code, self._base + offset, length)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Shared options are read-only.')
+
+class SharedOptions(object):
+    '''A read-only view of options published to shared memory by publish_shared().
+
+    Values are read with the same options.section.name syntax as the options
+    object. A view keeps reading the generation it attached to until refresh()
+    is called.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self._control = _attach_shared_memory(name)
+        self._load()
+
+    def _read_generation(self):
+        return _SHARED_GENERATION.unpack_from(self._control.buf, 0)[0]
+
+    def _load(self):
+        while True:
+            generation = self._read_generation()
+            try:
+                shm = _attach_shared_memory('{0}_{1}'.format(self.name, generation))
+                break
+            except FileNotFoundError:
+                if self._read_generation() == generation:
+                    raise # Not replaced by a newer generation in the meantime
+
+        magic, fmt, _, shm_generation, fingerprint, index_size = _SHARED_HEADER.unpack_from(shm.buf, 0)
+        if magic != _SHARED_MAGIC or fmt != 1 or shm_generation != generation:
+            raise OptionsError('Shared memory segment {0} does not contain published options.'.format(self.name))
+
+        index = marshal.loads(shm.buf[_SHARED_HEADER.size:_SHARED_HEADER.size + index_size])
+        base = _SHARED_HEADER.size + index_size
+
+        self.generation = generation
+        self.fingerprint = fingerprint.decode('ascii')
+        self._sections = dict((section, SharedOptionsSection(shm, base, dict((name, (code, offset, length)) for name, code, offset, length in entries))) for section, entries in index)
+
+    def refresh(self):
+        '''Switches to the most recently published generation. Returns True if it changed.'''
+
+        if self._read_generation() == self.generation:
+            return False
+
+        self._load()
+        return True
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_sections'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+def _config_watcher_class():
+    '''Returns the ConfigWatcher class, defined on first use so that importing groper does not import threading.'''
+
+    cls = globals().get('ConfigWatcher')
+    if cls is not None:
+        return cls
+
+    import threading, select
+
+    class ConfigWatcher(threading.Thread):
+        '''Watches a file and calls a function every time its contents may have changed.
+
+        Uses inotify where it is available and falls back to polling the file's
+        modification time and size every interval seconds.
+        '''
+
+        IN_ATTRIB = 0x04
+        IN_CLOSE_WRITE = 0x08
+        IN_MOVED_TO = 0x80
+        IN_CREATE = 0x100
+
+        def __init__(self, filename, callback, interval=1.0):
+            threading.Thread.__init__(self, name='groper-config-watcher')
+            self.daemon = True
+            self.filename = filename
+            self.callback = callback
+            self.interval = interval
+            self._stopped = threading.Event()
+            self._fingerprint = self._stat()
+            self._inotify_fd = None
+
+        def _stat(self):
+            try:
+                st = os.stat(self.filename)
+            except OSError:
+                return None
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+        def _inotify_watch(self):
+            '''Returns an inotify file descriptor watching the file's directory, or None.
+
+            The directory is watched rather than the file itself so that editors and
+            deployment tools that replace the file by renaming are noticed as well.
+            '''
+
+            try:
+                import ctypes, ctypes.util
+                libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+                fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            except (OSError, AttributeError):
+                return None
+
+            if fd < 0:
+                return None
+
+            mask = self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            if libc.inotify_add_watch(fd, os.fsencode(os.path.dirname(self.filename)), mask) < 0:
+                os.close(fd)
+                return None
+
+            return fd
+
+        def _wait(self):
+            if self._inotify_fd is None:
+                self._stopped.wait(self.interval)
+                return
+
+            readable = select.select([self._inotify_fd], [], [], self.interval)[0]
+            if readable:
+                try:
+                    while os.read(self._inotify_fd, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+        def run(self):
+            self._inotify_fd = self._inotify_watch()
+            try:
+                while not self._stopped.is_set():
+                    self._wait()
+
+                    fingerprint = self._stat()
+                    if fingerprint is not None and fingerprint != self._fingerprint:
+                        self._fingerprint = fingerprint
+                        self.callback()
+            finally:
+                if self._inotify_fd is not None:
+                    os.close(self._inotify_fd)
+
+        def stop(self, timeout=None):
+            '''Stops watching. Waits for the watcher thread to exit unless timeout is 0.'''
+
+            self._stopped.set()
+            if timeout != 0 and self.is_alive() and threading.current_thread() is not self:
+                self.join(timeout)
+
+    ConfigWatcher.__qualname__ = 'ConfigWatcher'
+    return globals().setdefault('ConfigWatcher', ConfigWatcher)
+
+def __getattr__(name):
+    if name == 'ConfigWatcher':
+        return _config_watcher_class()
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+def _expand_sources(sources):
+    '''Expands directories and glob patterns into an ordered list of files.'''
+
+    import glob
+
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files.extend(sorted(os.path.join(source, name) for name in os.listdir(source) if not name.startswith('.') and os.path.isfile(os.path.join(source, name))))
+        elif any(c in source for c in '*?['):
+            files.extend(sorted(filename for filename in glob.glob(source) if os.path.isfile(filename)))
+        else:
+            files.append(source)
+
+    return [os.path.abspath(filename) for filename in files]
+
+# Idle keep-alive connections of _http_get(), by (scheme, host:port)
+_http_pool = {}
+_http_pool_lock = _thread.allocate_lock()
+
+def _http_get(key, path, headers, timeout):
+    '''Sends a GET request on a pooled keep-alive connection. Returns the response and its body.
+
+    A pooled connection may have been closed by the server while it was idle, so
+    a request that fails on one is sent again on another connection.
+    '''
+
+    import http.client
+
+    with _http_pool_lock:
+        idle = _http_pool.get(key)
+        conn = idle.pop() if idle else None
+
+    pooled = conn is not None
+    if not pooled:
+        conn_class = http.client.HTTPSConnection if key[0] == 'https' else http.client.HTTPConnection
+        conn = conn_class(key[1], timeout=timeout)
+    elif conn.sock is not None:
+        conn.sock.settimeout(timeout)
+
+    try:
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+    except (OSError, http.client.HTTPException):
+        conn.close()
+        if pooled:
+            return _http_get(key, path, headers, timeout)
+        raise
+
+    if response.will_close:
+        conn.close()
+    else:
+        with _http_pool_lock:
+            _http_pool.setdefault(key, []).append(conn)
+
+    return response, body
+
+class _HTTPConfigSource(object):
+    '''A configuration file served over HTTP, fetched with conditional requests.
+
+    The last body and its ETag and Last-Modified validators are kept and, if
+    cache_file is given, saved to it for starts while the server is unreachable.
+    The cache file holds the body preceded by comment lines with the validators,
+    so it is a valid configuration file as well.
+    '''
+
+    _CACHE_HEADERS = (('etag', '# groper-etag: '), ('last_modified', '# groper-last-modified: '))
+
+    def __init__(self, url, cache_file=None, timeout=10.0):
+        from urllib.parse import urlsplit, urlunsplit
+
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.netloc:
+            raise OptionsError('{0} is not an http or https URL.'.format(url))
+
+        self.url = url
+        self.key = (parts.scheme, parts.netloc)
+        self.path = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        self.cache_file = cache_file
+        self.timeout = timeout
+        self.etag = None
+        self.last_modified = None
+        self.body = None
+        self.offline = False # True while the body comes from cache_file because the server could not be reached
+        self._delivered = False
+
+        if cache_file:
+            self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as fp:
+                body = fp.read()
+        except OSError:
+            return
+
+        for attr, prefix in self._CACHE_HEADERS:
+            if body.startswith(prefix):
+                line, _, body = body.partition('\n')
+                setattr(self, attr, line[len(prefix):])
+        self.body = body
+
+    def _save_cache(self):
+        import tempfile
+
+        lines = [prefix + getattr(self, attr) + '\n' for attr, prefix in self._CACHE_HEADERS if getattr(self, attr)]
+        tmp_file = None
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.cache_file)), prefix='.groper-http-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+                fp.write(''.join(lines) + self.body)
+            os.replace(tmp_file, self.cache_file)
+        except OSError: # Caching is best effort
+            if tmp_file and os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+
+    def fetch(self):
+        '''Fetches the configuration if it changed. Returns (body, changed).
+
+        changed is False if the server answered 304 Not Modified to a body that was
+        already returned. If the server cannot be reached or fails, the body saved
+        in cache_file is returned once; after that the error is raised.
+        '''
+
+        import http.client
+
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        try:
+            response, body = _http_get(self.key, self.path, headers, self.timeout)
+            if response.status >= 500:
+                raise OSError('HTTP {0} {1}'.format(response.status, response.reason))
+        except (OSError, http.client.HTTPException) as e:
+            if self.body is None or self._delivered:
+                raise OptionsUserError('Could not fetch configuration file {0}: {1}'.format(self.url, e))
+            self.offline = self._delivered = True
+            return self.body, True
+
+        self.offline = False
+        if response.status == 304 and self.body is not None:
+            changed, self._delivered = not self._delivered, True
+            return self.body, changed
+
+        if response.status != 200:
+            raise OptionsUserError('Could not fetch configuration file {0}: HTTP {1} {2}'.format(self.url, response.status, response.reason))
+
+        body = body.decode('utf-8')
+        changed = body != self.body or not self._delivered
+        self.body = body
+        self.etag = response.getheader('ETag')
+        self.last_modified = response.getheader('Last-Modified')
+        self._delivered = True
+        if self.cache_file:
+            self._save_cache()
+
+        return body, changed
 
 def OptionsMeta(print_func=None):
     '''Creates a private scope for the options manupulation functions and returns them.
@@ -23,17 +968,16 @@ def OptionsMeta(print_func=None):
     print_func = print_func or print # Pass in a custom print function to use, e.g. stderr
 
     option_definitions = {}
-    cp = RawConfigParser()
-    adapters = {
-        bool: cp.getboolean,
-        float: cp.getfloat,
-        int: cp.getint,
-    }
+    parser_state = {'parser': None} # The RawConfigParser of parse_config(), created on first use
+    converters = dict(_converters)
+    conversion_cache = {} # (type, raw string): converted value
 
     config_file_def = {
         'section': None,
         'optname': None,
         'filename': None,
+        'compiled': None, # Set by load_compiled(), which makes the configuration file optional
+        'layers': None, # The files read by the last parse_configs() call, reloaded together
     }
 
     # Variables we will return
@@ -42,32 +986,148 @@ def OptionsMeta(print_func=None):
     cmdarg_defs = {
         'count': None,
         'args': None,
+        'response_files': False,
+        'stdin': False,
+    }
+
+    # Positional arguments streamed by iter_args(), and those read ahead by verify_all_options()
+    args_state = {
+        'iter': None,
+        'buffer': [],
     }
     _type = type
 
+    snapshot_state = {
+        'current': None,
+    }
 
-    def generate_sample_config():
-        '''Returns a string containing a sample configuration file based on the defined options.'''
+    # Configuration files read while an init_options(stats=True) call is collecting them
+    read_stats = {
+        'files': None,
+    }
 
-        f = StringIO()
-        try:
-            for section in option_definitions:
-                f.write('[{0}]\n'.format(section))
+    # Shared memory segments created by publish_shared()
+    shared_state = {
+        'control': None,
+        'data': None,
+    }
 
-                for name, opt in option_definitions[section].items():
-                    if opt.cmd_only:
-                        continue
+    # Environment variable names of the options, built by parse_env()
+    env_state = {
+        'key': None,
+        'index': None,
+    }
 
-                    opt_name = name if hasattr(opt, 'default') else '#{0}'.format(name)
-                    opt_val = '{0}'.format(opt.default) if hasattr(opt, 'default') else '<{0}>'.format(name.upper())
+    # Required options without a value and options whose default has not been
+    # set yet, as insertion-ordered dicts used as sets. Every source removes the
+    # options it sets, so set_defaults() and verify_all_options() only visit
+    # what is still missing.
+    unresolved = {
+        'required': {},
+        'defaults': {},
+    }
 
-                    f.write('{0} = {1}\n'.format(opt_name, opt_val))
+    # The _HTTPConfigSource of each URL read by parse_url() and reload_url()
+    http_sources = {}
 
-                f.write("\n")
+    # Classes and options of the namespaces created by new_namespace(), for a schema version
+    namespace_state = {
+        'version': None,
+        'layout': None,
+    }
 
-            return f.getvalue()
-        finally:
-            f.close()
+    # Templates of options defined with interpolate=True, by (section, name):
+    # their raw value, its parts and references, the templates referencing each
+    # option, and the templates to evaluate again
+    interpolation = {
+        'templates': {},
+        'parts': {},
+        'refs': {},
+        'dependents': {},
+        'dirty': set(),
+    }
+
+    # Commands defined by define_command(), as name: (loader, help), the chosen
+    # one and those whose loader has run
+    command_state = {
+        'commands': {},
+        'selected': None,
+        'loading': None,
+        'loaded': set(),
+    }
+
+    # Resolution deferred by init_options(lazy=True)
+    lazy_state = {
+        'pending': None,
+        'lock': _thread.RLock(),
+    }
+
+    # Lookup tables used by parse_args(), built by compile_schema(), the schema
+    # fingerprint used to validate cached configuration files, and a counter
+    # incremented every time options or arguments are defined
+    schema_state = {
+        'compiled': None,
+        'frozen': False,
+        'fingerprint': None,
+        'version': 0,
+    }
+
+    output_cache = {
+        'version': None,
+        'usage': {},
+        'sample_config': None,
+    }
+
+    def _output_cache():
+        '''Returns the cached usage() and generate_sample_config() outputs, discarding them if the schema changed.'''
+
+        if output_cache['version'] != schema_state['version']:
+            output_cache['version'] = schema_state['version']
+            output_cache['usage'] = {}
+            output_cache['sample_config'] = None
+
+        return output_cache
+
+    def _write_sample_config(f):
+        for section in option_definitions:
+            f.write('[{0}]\n'.format(section))
+
+            for name, opt in option_definitions[section].items():
+                if opt.cmd_only:
+                    continue
+
+                opt_name = name if opt.default is not NO_DEFAULT else '#{0}'.format(name)
+                opt_val = getattr(converters.get(opt.type, opt.type), 'to_string', str)(opt.default) if opt.default is not NO_DEFAULT else '<{0}>'.format(name.upper())
+
+                f.write('{0} = {1}\n'.format(opt_name, opt_val))
+
+            f.write("\n")
+
+    def generate_sample_config(fp=None):
+        '''Returns a string containing a sample configuration file based on the defined options.
+
+        If a file object fp is given, the sample configuration is written to it
+        instead, without building the whole string first, and None is returned.
+        The output is cached until the next define_opt() call.'''
+
+        cache = _output_cache()
+
+        if fp is not None:
+            if cache['sample_config'] is not None:
+                fp.write(cache['sample_config'])
+            else:
+                _write_sample_config(fp)
+            return None
+
+        if cache['sample_config'] is None:
+            f = StringIO()
+            try:
+                _write_sample_config(f)
+                cache['sample_config'] = f.getvalue()
+            finally:
+                f.close()
+
+        return cache['sample_config']
 
     def _option_usage(option):
         '''Create an option usage line part based on option definition.
@@ -111,23 +1171,44 @@ def OptionsMeta(print_func=None):
             return ' '.join(['<{0}>'.format(s) for s in cmdarg_defs['args']])
 
     def usage(cmd_name=None):
-        '''Returns usage/help string based on defined options.'''
+        '''Returns usage/help string based on defined options.
+
+        The output is cached until the next define_opt() or define_args() call.'''
 
         cmd_name = cmd_name or os.path.basename(sys.argv[0])
 
+        key = (cmd_name, command_state['selected'])
+        cache = _output_cache()['usage']
+        if key not in cache:
+            cache[key] = _usage(cmd_name)
+        return cache[key]
+
+    def _usage(cmd_name):
         lines = ['Usage:', '',]
 
+        commands = command_state['commands']
+        selected = command_state['selected']
+        if selected:
+            cmd_name = '{0} {1}'.format(cmd_name, selected)
+
         # Group all options
         cmd_options = {}
         for section in option_definitions:
             for name, opt in option_definitions[section].items():
+                if opt.command is not None and opt.command != selected:
+                    continue
+
                 if opt.cmd_name or opt.cmd_short_name:
                     if opt.cmd_group not in cmd_options:
                         cmd_options[opt.cmd_group] = []
                     cmd_options[opt.cmd_group].append(opt)
 
-        if not cmd_options and cmdarg_defs['count']:
+        if commands and not selected:
+            arg_line = '<command> ...'
+        else:
             arg_line = _args_usage(cmdarg_defs)
+
+        if not cmd_options and arg_line:
             lines.append('{0} {1}'.format(cmd_name, arg_line))
 
         # Create lines
@@ -135,9 +1216,8 @@ def OptionsMeta(print_func=None):
             short_line = []
             long_line = []
 
-            group.sort(key=lambda a: a.name) # Sort alphabetically
-            group.sort(key=lambda a: int(a.required)) # Sort by required options first
-            
+            group.sort(key=lambda a: (int(a.required), a.name)) # Sort by required, then alphabetically
+
             for option in group:
                 s, l = _option_usage(option)
                 if s:
@@ -145,8 +1225,6 @@ def OptionsMeta(print_func=None):
                 if l:
                     long_line.append(l)
 
-            arg_line = _args_usage(cmdarg_defs)
-
             if arg_line:
                 short_line.append(arg_line)
                 long_line.append(arg_line)
@@ -156,9 +1234,15 @@ def OptionsMeta(print_func=None):
             if long_line:
                 lines.append('{0} {1}'.format(cmd_name, ' '.join(long_line)))
 
+        if commands and not selected:
+            lines.extend(['', 'Commands:', ''])
+            width = max(len(name) for name in commands)
+            for name, (loader, help) in commands.items():
+                lines.append('  {0}  {1}'.format(name.ljust(width), help or '').rstrip())
+
         return '\n'.join(lines)
 
-    def define_args(args=None):
+    def define_args(args=None, response_files=False, stdin=False):
         '''Defines required/optional arguments.
 
         The args parameter can be in the following forms:
@@ -166,25 +1250,36 @@ def OptionsMeta(print_func=None):
             to be printed when program usage is being shown.
             NOTE: num can be -1 for "0 or more agruments" and -2 for "one or more arguments"
           - (arg1, arg2, arg3): Require three arguments, each with a different name.
+
+        If response_files is True, an @path argument is replaced by the lines of
+        that file, one argument per line, @- reads them from standard input and
+        @@ stands for a literal @. If stdin is True and no argument is given on the
+        command line, arguments are read from standard input, one per line. In both
+        cases arguments are streamed by iter_args() instead of being stored in
+        cmdargs, which stays empty.
         '''
 
+        cmdarg_defs['response_files'] = response_files
+        cmdarg_defs['stdin'] = stdin
+
         if len(args) == 2 and type(args[0]) in set((int, int)) and isinstance(args[1], str):
             cmdarg_defs['count'] = args[0]
             cmdarg_defs['args'] = [args[1]] * abs(args[0])
+            schema_state['version'] += 1
             return
         elif hasattr(args, '__iter__'):
             cmdarg_defs['count'] = len(args)
             cmdarg_defs['args'] = tuple(args)
+            schema_state['version'] += 1
             return
 
         raise OptionsError('Define either (count, argname) (use -1 for zero or more, -2 for one or more) or a list of argument names.')
 
-    def define_opt(section, name, cmd_name=None, cmd_short_name=None, cmd_only=False, type=str, is_config_file=False, is_help=False, help=None, cmd_group='default', **kwargs):
-        '''Defines an option. Should be run before init_options().
+    def _make_definition(section, name, cmd_name=None, cmd_short_name=None, cmd_only=False, type=str, is_config_file=False, is_help=False, help=None, cmd_group='default', interpolate=False, **kwargs):
+        '''Validates the arguments of define_opt() and returns a new OptionDefinition.
 
-           Note that you may pass in one additional kwarg: default.
-           If this argument is not specified, the option is required, and
-           will have to be set from either a config file or the command line.
+        Raises an OptionsError if the option is invalid or already defined. Does
+        not add the option to the schema.
         '''
 
         if not isinstance(section, str):
@@ -199,28 +1294,24 @@ def OptionsMeta(print_func=None):
         if cmd_short_name and not isinstance(cmd_short_name, str):
             raise OptionsError('cmd_short_name {0} must be a string, not a {1}'.format(cmd_short_name, _type(cmd_short_name)))
 
-        section = section.lower().strip()
+        section = sys.intern(section.lower().strip()) # Shared by all the definitions of the section
         name = name.lower().strip()
         if cmd_name:
             cmd_name = cmd_name.lower().strip()
 
-        if not re.match('^[a-z_]+[a-z0-9_]*$', section):
+        if not _is_name(section, _LOWERCASE + '_', _LOWERCASE + _DIGITS + '_'):
             raise OptionsError('{0} is not a valid section name. It must contain only letters, numbers and underscores.'.format(section))
 
-        if not re.match('^[a-z_]+[a-z0-9_]*$', name):
+        if not _is_name(name, _LOWERCASE + '_', _LOWERCASE + _DIGITS + '_'):
             raise OptionsError('{0} is not a valid name. It must contain only letters, numbers and underscores.'.format(name))
 
-        if cmd_name and not re.match('^[a-z0-9]+[a-z0-9-]*$', cmd_name):
-            raise OptionsError('{0} is not a valid cmd_name. It must contain only letters, numbers and dashes.'.format(cmd_short_name))
+        if cmd_name and not _is_name(cmd_name, _LOWERCASE + _DIGITS, _LOWERCASE + _DIGITS + '-'):
+            raise OptionsError('{0} is not a valid cmd_name. It must contain only letters, numbers and dashes.'.format(cmd_name))
 
-        if cmd_short_name and (len(cmd_short_name) != 1 or not re.match('^[a-zA-Z0-9]{1}$', cmd_short_name)):
+        if cmd_short_name and (len(cmd_short_name) != 1 or cmd_short_name not in _LOWERCASE + _LOWERCASE.upper() + _DIGITS):
             raise OptionsError('{0} is not a valid cmd_short_name. It must contain only letters or numbers and be of length 1.'.format(cmd_short_name))
 
-        if not hasattr(options, section):
-            setattr(options, section, OptionObject())
-            option_definitions[section] = {}
-
-        if name in option_definitions[section]:
+        if name in option_definitions.get(section, ()):
             raise OptionsError('Option {0}.{1} is already defined.'.format(section, name))
 
         if cmd_only and not (cmd_name or cmd_short_name):
@@ -230,7 +1321,7 @@ def OptionsMeta(print_func=None):
             raise OptionsError('Option {0}.{1} is defined as is_config_file, but with {2} instead of {3}.'.format(section, name, type, _type('')))
 
         if is_config_file and config_file_def['section']:
-            raise OptionsError('Duplicate is_config_file options {0}.{1} and {2}.{3}.'.format(section, name, config_file_def['section'], config_file_def['name']))
+            raise OptionsError('Duplicate is_config_file options {0}.{1} and {2}.{3}.'.format(section, name, config_file_def['section'], config_file_def['optname']))
 
         if is_config_file and not (cmd_name or cmd_short_name):
             raise OptionsError('Option {0}.{1} is defined as is_config_file, but cmd_name and cmd_short_name are not specified.'.format(section, name))
@@ -238,179 +1329,1505 @@ def OptionsMeta(print_func=None):
         if is_help and not isinstance(type(), bool):
             raise OptionsError('Option {0}.{1} is defined as is_help, but with {2} instead of {3}.'.format(section, name, type, bool))
 
-        option_definitions[section][name] = OptionObject(
+        if 'default' in kwargs:
+            default = kwargs['default']
+        elif type == bool:
+            default = False
+        else:
+            default = NO_DEFAULT
+
+        return OptionDefinition(
             section=section,
             name=name,
             cmd_name=cmd_name,
             cmd_short_name=cmd_short_name,
-            required=False,
             type=type,
             is_config_file=is_config_file,
             is_help=is_help,
             cmd_group=cmd_group,
             cmd_only=cmd_only or is_config_file or is_help,
-            set_by=None,
+            default=default,
+            interpolate=interpolate,
         )
 
-        if 'default' in kwargs:
-            option_definitions[section][name].default = kwargs['default']
-        elif type == bool:
-            option_definitions[section][name].default = False
-        else:
-            option_definitions[section][name].required = True
+    def _add_definitions(definitions):
+        for opt in definitions:
+            opt.command = command_state['loading']
 
-        if is_config_file:
-            config_file_def['section'] = section
-            config_file_def['optname'] = name
+            if opt.section not in option_definitions:
+                setattr(options, opt.section, OptionObject())
+                option_definitions[opt.section] = {}
 
-            if 'default' in kwargs:
-                config_file_def['filename'] = kwargs['default']
+            option_definitions[opt.section][opt.name] = opt
 
-    def parse_config(config_file=None):
-        '''Parses a configuration file.
+            if opt.default is not NO_DEFAULT:
+                unresolved['defaults'][opt] = None
+            elif opt.name not in vars(getattr(options, opt.section)):
+                unresolved['required'][opt] = None
 
-        This function sets option values if not already set by the parse_args() function.'''
+            if opt.is_config_file:
+                config_file_def['section'] = opt.section
+                config_file_def['optname'] = opt.name
 
-        if not config_file:
-            if not config_file_def['filename']:
-                raise OptionsError('You must pass a config_file path to parse_config() or define a command line option is_config_file=True with an optional default.')
-            config_file = config_file_def['filename']
+                if opt.default is not NO_DEFAULT:
+                    config_file_def['filename'] = opt.default
 
-        config_file = os.path.abspath(config_file)
-        if not os.path.exists(config_file):
-            raise OptionsUserError('Configuration file {0} does not exist.'.format(config_file))
+        schema_state['compiled'] = None
+        schema_state['fingerprint'] = None
+        schema_state['version'] += 1
 
-        cp.readfp(codecs.open(config_file, 'r', 'utf-8'))
+    def define_opt(section, name, cmd_name=None, cmd_short_name=None, cmd_only=False, type=str, is_config_file=False, is_help=False, help=None, cmd_group='default', interpolate=False, **kwargs):
+        '''Defines an option. Should be run before init_options().
 
+           Note that you may pass in one additional kwarg: default.
+           If this argument is not specified, the option is required, and
+           will have to be set from either a config file or the command line.
+
+           If interpolate is True, ${section.name} and ${name} in the option's
+           value, including its default, are replaced with the values of those
+           options by verify_all_options(). $$ is a literal $.
+        '''
+
+        if schema_state['frozen']:
+            raise OptionsError('Cannot define option {0}.{1}: the options schema has been frozen by compile_schema().'.format(section, name))
+
+        _add_definitions([_make_definition(section, name, cmd_name, cmd_short_name, cmd_only, type, is_config_file, is_help, help, cmd_group, interpolate, **kwargs)])
+
+    def define_opts(specs):
+        '''Defines many options at once.
+
+        specs is either a dict mapping (section, name) tuples to dicts of
+        define_opt() keyword arguments, or an iterable of option specs. Each spec is
+        a dict of define_opt() keyword arguments including section and name, or a
+        (section, name) or (section, name, kwargs) tuple.
+
+        All the specs are validated before any option is defined. If any of them is
+        invalid, a single OptionsError listing every problem is raised and no option
+        is defined.
+        '''
+
+        if schema_state['frozen']:
+            raise OptionsError('Cannot define options: the options schema has been frozen by compile_schema().')
+
+        if isinstance(specs, dict):
+            specs = [(section, name, kwargs) for (section, name), kwargs in specs.items()]
+
+        definitions = []
+        defined = set()
+        config_file_opt = None
+        errors = []
+
+        for spec in specs:
+            try:
+                if isinstance(spec, dict):
+                    opt = _make_definition(**spec)
+                else:
+                    opt = _make_definition(spec[0], spec[1], **(spec[2] if len(spec) > 2 else {}))
+            except (OptionsError, TypeError, IndexError) as e:
+                errors.append('{0}: {1}'.format(spec, e) if not isinstance(e, OptionsError) else str(e))
+                continue
+
+            if (opt.section, opt.name) in defined:
+                errors.append('Option {0}.{1} is already defined.'.format(opt.section, opt.name))
+                continue
+
+            if opt.is_config_file:
+                if config_file_opt:
+                    errors.append('Duplicate is_config_file options {0}.{1} and {2}.{3}.'.format(opt.section, opt.name, config_file_opt.section, config_file_opt.name))
+                    continue
+                config_file_opt = opt
+
+            defined.add((opt.section, opt.name))
+            definitions.append(opt)
+
+        if errors:
+            raise OptionsError('\n'.join(errors))
+
+        _add_definitions(definitions)
+
+    def _config_file_path(config_file):
+        if not config_file:
+            if not config_file_def['filename']:
+                raise OptionsError('You must pass a config_file path to parse_config() or define a command line option is_config_file=True with an optional default.')
+            config_file = config_file_def['filename']
+
+        config_file = os.path.abspath(config_file)
+        if not os.path.exists(config_file):
+            raise OptionsUserError('Configuration file {0} does not exist.'.format(config_file))
+
+        return config_file
+
+    def _config_value(parser, config_file, opt):
+        '''Reads and converts a single option from a parsed configuration file.'''
+
+        try:
+            return _convert_option(opt, parser.get(opt.section, opt.name))
+        except ValueError:
+            raise OptionsUserError('Could not parse configuration file {0}: section {1} option {2} must be of type {3}, not {4}'.format(config_file, opt.section, opt.name, opt.type.__name__, parser.get(opt.section, opt.name)))
+
+    def _wanted_options():
+        '''Returns the names of the options a configuration file can set, by section, for _read_config_stream().'''
+
+        wanted = {}
         for section in option_definitions:
-            if cp.has_section(section):
-                for name in option_definitions[section]:
-                    if option_definitions[section][name].set_by is not None:
-                        continue
+            wanted[section] = set(name for name, opt in option_definitions[section].items() if not opt.cmd_only)
+        return wanted
+
+    def _stream_config_file(config_file):
+        '''Reads only the defined, non cmd_only options of a configuration file with _read_config_stream().'''
+
+        with open(config_file, 'r', encoding='utf-8') as fp:
+            _record_read(config_file, os.fstat(fp.fileno()).st_size)
+            return _read_config_stream(fp, config_file, _wanted_options())
+
+    def _record_read(config_file, size):
+        files = read_stats['files']
+        if files is not None:
+            files.append((config_file, size))
+
+    def _read_config(parser, config_file, only_unset=True):
+        '''Converts the defined options found in a parsed configuration file.
+
+        Returns a dict mapping (section, name) to (value, error), in definition
+        order. error is an error message for options that could not be converted
+        or required options missing from a section present in the file, else None.
+        '''
+
+        resolved = {}
+        for section in option_definitions:
+            if not parser.has_section(section):
+                continue
+
+            for name, opt in option_definitions[section].items():
+                if opt.cmd_only or (only_unset and opt.set_by is not None):
+                    continue
+
+                if parser.has_option(section, name):
+                    try:
+                        resolved[(section, name)] = (_config_value(parser, config_file, opt), None)
+                    except OptionsUserError as e:
+                        resolved[(section, name)] = (None, str(e))
+                elif opt.default is NO_DEFAULT:
+                    resolved[(section, name)] = (None, 'Could not parse configuration file {0}: section {1} option {2} was not found'.format(config_file, section, name))
+
+        return resolved
+
+    def _apply_config(resolved, config_file, sources=None):
+        '''Sets the options resolved from configuration files that are not set yet.
+
+        sources optionally maps (section, name) to the file each value came from,
+        when it is not config_file.
+        '''
+
+        for key, (value, error) in resolved.items():
+            opt = option_definitions[key[0]][key[1]]
+            if opt.set_by is not None:
+                continue
+
+            if error:
+                raise OptionsUserError(error)
+
+            _set_option(opt, value, parse_config, sources[key] if sources else config_file)
+
+    def _mark_resolved(opt):
+        unresolved['required'].pop(opt, None)
+        unresolved['defaults'].pop(opt, None)
+
+    def _set_option(opt, value, set_by, source=None):
+        '''Sets an option's value on behalf of set_by, one of the parse_* functions.'''
+
+        _set_value(opt, value)
+        opt.set_by = set_by
+        opt.source = source
+        _mark_resolved(opt)
+
+    def _set_value(opt, value):
+        '''Sets an option's value, or its template if value is a _Template.'''
+
+        if _type(value) is _Template:
+            _set_template(opt, value.raw)
+            return
+
+        if interpolation['templates']:
+            _drop_template(opt)
+        setattr(getattr(options, opt.section), opt.name, value)
+        _value_changed(opt)
+
+    def _convert_option(opt, value):
+        '''Converts a raw string for an option, or returns a _Template for _interpolate() if it contains references.'''
+
+        if opt.interpolate and '$' in value:
+            return _Template(value)
+        return _convert(opt.type, value)
+
+    def _default_value(opt):
+        if opt.interpolate and isinstance(opt.default, str) and '$' in opt.default:
+            return _Template(opt.default)
+        return opt.default
+
+    def _set_template(opt, raw, dirty=True):
+        key = (opt.section, opt.name)
+        if interpolation['templates'].get(key) == raw:
+            return # Evaluated already, unless one of its references changed
+
+        _drop_template(opt)
+        parts = _parse_template(raw, opt.section)
+        refs = set(part for part in parts if _type(part) is tuple)
+
+        interpolation['templates'][key] = raw
+        interpolation['parts'][key] = parts
+        interpolation['refs'][key] = refs
+        for ref in refs:
+            interpolation['dependents'].setdefault(ref, set()).add(key)
+        if dirty:
+            interpolation['dirty'].add(key)
+
+    def _drop_template(opt):
+        key = (opt.section, opt.name)
+        if key not in interpolation['templates']:
+            return
+
+        for ref in interpolation['refs'].pop(key):
+            interpolation['dependents'][ref].discard(key)
+        del interpolation['templates'][key]
+        del interpolation['parts'][key]
+        interpolation['dirty'].discard(key)
+
+    def _value_changed(opt):
+        dependents = interpolation['dependents'].get((opt.section, opt.name))
+        if dependents:
+            interpolation['dirty'].update(dependents)
+
+    def _interpolate():
+        '''Evaluates the templates that changed or reference options that changed, and everything downstream of them.
+
+        Templates are evaluated in dependency order, each once. Returns a dict
+        mapping (section, name) to (old_value, new_value) for every option whose
+        value changed.
+        '''
+
+        dirty = interpolation['dirty']
+        if not dirty:
+            return {}
+
+        templates, refs, dependents = interpolation['templates'], interpolation['refs'], interpolation['dependents']
+
+        pending = set()
+        stack = list(dirty)
+        while stack:
+            key = stack.pop()
+            if key not in pending and key in templates:
+                pending.add(key)
+                stack.extend(dependents.get(key, ()))
+
+        # Topological order, by repeatedly taking templates whose pending references are all evaluated
+        waiting = dict((key, len(refs[key] & pending)) for key in pending)
+        ready = [key for key, count in waiting.items() if count == 0]
+        order = []
+        while ready:
+            key = ready.pop()
+            order.append(key)
+            for dependent in dependents.get(key, ()):
+                if dependent in waiting:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        ready.append(dependent)
+
+        if len(order) < len(pending):
+            cycle = sorted('{0}.{1}'.format(*key) for key, count in waiting.items() if count > 0)
+            raise OptionsUserError('Options {0} reference each other in a cycle.'.format(', '.join(cycle)))
+
+        changes = {}
+        for key in order:
+            opt = option_definitions[key[0]][key[1]]
+
+            text = []
+            for part in interpolation['parts'][key]:
+                if _type(part) is not tuple:
+                    text.append(part)
+                    continue
+
+                ref = option_definitions.get(part[0], {}).get(part[1])
+                if ref is None:
+                    raise OptionsUserError('Option {0}.{1} references {2}.{3}, which is not defined.'.format(key[0], key[1], part[0], part[1]))
+                ref_values = vars(getattr(options, ref.section))
+                if ref.name not in ref_values:
+                    raise OptionsUserError('Option {0}.{1} references {2}.{3}, which is not set.'.format(key[0], key[1], part[0], part[1]))
+                text.append(getattr(converters.get(ref.type, ref.type), 'to_string', str)(ref_values[ref.name]))
+
+            try:
+                value = _convert(opt.type, ''.join(text))
+            except ValueError:
+                raise OptionsUserError('Could not interpolate option {0}.{1}: {2} must be of type {3}.'.format(key[0], key[1], ''.join(text), opt.type.__name__))
+
+            section_values = vars(getattr(options, opt.section))
+            old_value = section_values.get(opt.name)
+            if opt.name not in section_values or old_value != value or _type(old_value) != _type(value):
+                setattr(getattr(options, opt.section), opt.name, value)
+                changes[key] = (old_value, value)
+            dirty.discard(key)
+
+        return changes
+
+    def register_converter(type, converter):
+        '''Registers converter(raw_string) to convert values of options of the given type.
+
+        Options whose type has no converter are converted by calling the type on
+        the raw string. Conversions are memoized by raw string, so converter
+        should not depend on anything else.
+        '''
+
+        converters[type] = converter
+        conversion_cache.clear()
+        schema_state['fingerprint'] = None
+        schema_state['version'] += 1
+
+    def _convert(opt_type, value):
+        '''Converts a raw string from a configuration file, the environment or the command line to opt_type.'''
+
+        if opt_type is str and str not in converters:
+            return value
+
+        key = (opt_type, value)
+        result = conversion_cache.get(key, NO_DEFAULT)
+        if result is NO_DEFAULT:
+            convert = converters.get(opt_type, opt_type)
+            result = convert.convert(value, converters) if isinstance(convert, ListOf) else convert(value)
+            if _type(result) not in _immutable_types and _type(result) not in _copy_value:
+                return result
+
+            if len(conversion_cache) >= _CONVERSION_CACHE_SIZE:
+                conversion_cache.clear()
+            conversion_cache[key] = result
+
+        copy = _copy_value.get(_type(result))
+        return copy(result) if copy else result
+
+    def _schema_fingerprint():
+        '''Returns a digest of everything in the option definitions that affects how a configuration file is resolved.'''
+
+        if schema_state['fingerprint'] is None:
+            import hashlib
+
+            type_names = {}
+            for section in option_definitions:
+                for opt in option_definitions[section].values():
+                    if opt.type not in type_names:
+                        converter = converters.get(opt.type)
+                        type_names[opt.type] = '{0}.{1}/{2}.{3}'.format(
+                            getattr(opt.type, '__module__', None),
+                            getattr(opt.type, '__qualname__', repr(opt.type)),
+                            getattr(converter, '__module__', None),
+                            getattr(converter, '__qualname__', repr(converter)),
+                        )
+
+            digest = hashlib.sha1()
+            for section in option_definitions:
+                digest.update(repr([(section, name, type_names[opt.type], opt.cmd_only, opt.interpolate, repr(opt.default)) for name, opt in option_definitions[section].items()]).encode('utf-8'))
+            schema_state['fingerprint'] = digest.hexdigest()
+
+        return schema_state['fingerprint']
+
+    def _cached_config(config_file, cache_file):
+        '''Returns the resolved values of a configuration file, from cache_file if it is still valid.
+
+        The cache is keyed by the configuration file path, its modification time,
+        size and content hash, and the schema fingerprint. On a miss the file is
+        parsed on its own and the cache is rewritten atomically.
+        '''
+
+        import hashlib, pickle, tempfile
+
+        digest = hashlib.sha1()
+        with open(config_file, 'rb') as fp:
+            st = os.fstat(fp.fileno())
+            for chunk in iter(lambda: fp.read(1 << 16), b''):
+                digest.update(chunk)
+
+        key = (config_file, st.st_mtime_ns, st.st_size, digest.hexdigest(), _schema_fingerprint())
+        _record_read(config_file, st.st_size)
+
+        try:
+            with open(cache_file, 'rb') as fp:
+                cached = pickle.load(fp)
+            if cached['key'] == key:
+                return cached['resolved']
+        except Exception: # A missing, truncated or incompatible cache file is just a miss
+            pass
+
+        resolved = _read_config(_stream_config_file(config_file), config_file, only_unset=False)
+
+        try:
+            payload = pickle.dumps({'key': key, 'resolved': resolved}, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return resolved # Values of this type cannot be cached
+
+        tmp_file = None
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)), prefix='.groper-cache-')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(payload)
+            os.replace(tmp_file, cache_file)
+        except OSError: # Caching is best effort
+            if tmp_file and os.path.exists(tmp_file):
+                os.unlink(tmp_file)
 
-                    if option_definitions[section][name].cmd_only:
+        return resolved
+
+    def parse_config(config_file=None, cache_file=None, streaming=False):
+        '''Parses a configuration file.
+
+        This function sets option values if not already set by the parse_args() function.
+
+        If cache_file is given, the resolved and converted values are stored in it
+        and reused by later calls until the configuration file or the option
+        definitions change.
+
+        If streaming is True, the file is read line by line and only the defined
+        options are kept, instead of loading all of it into the RawConfigParser
+        shared by every parse_config() call. Caching implies streaming.'''
+
+        config_file = _config_file_path(config_file)
+
+        if cache_file:
+            resolved = _cached_config(config_file, cache_file)
+        elif streaming:
+            resolved = _read_config(_stream_config_file(config_file), config_file)
+        else:
+            parser = parser_state['parser']
+            if parser is None:
+                from configparser import RawConfigParser
+                parser = parser_state['parser'] = RawConfigParser()
+
+            with codecs.open(config_file, 'r', 'utf-8') as fp:
+                _record_read(config_file, os.fstat(fp.fileno()).st_size)
+                parser.read_file(fp)
+            resolved = _read_config(parser, config_file)
+
+        _apply_config(resolved, config_file)
+
+    def _expand_config_sources(sources):
+        '''Expands directories and glob patterns into an ordered list of existing files.'''
+
+        return [_config_file_path(filename) for filename in _expand_sources(sources)]
+
+    def validate_config(config_file):
+        '''Returns the list of every error parse_config() could raise for a configuration file, without setting any option.
+
+        Required options that cannot be given on the command line are reported as
+        verify_all_options() would if the file does not set them. The list is empty
+        if the file is valid.
+        '''
+
+        from configparser import Error as ConfigParserError
+
+        try:
+            parser = _stream_config_file(config_file)
+        except OSError as e:
+            return ['Could not read configuration file {0}: {1}'.format(config_file, e.strerror or e)]
+        except ConfigParserError as e:
+            return [str(e)]
+
+        resolved = _read_config(parser, config_file, only_unset=False)
+        errors = [error for value, error in resolved.values() if error]
+
+        # Required options that only a configuration file can set, in sections it does not have
+        for section in option_definitions:
+            for name, opt in option_definitions[section].items():
+                if opt.default is NO_DEFAULT and (section, name) not in resolved and not (opt.cmd_only or opt.cmd_name or opt.cmd_short_name or opt.command):
+                    errors.append('Required option {0}.{1} was not specified in the config file.'.format(section, name))
+
+        return errors
+
+    def parse_configs(sources, max_workers=None):
+        '''Parses several configuration files as ordered layers.
+
+        sources is a list of file paths, directories and glob patterns, for example
+        ['/etc/app.conf', '/etc/app.conf.d/*.conf']. Directories and patterns
+        expand to their files in sorted order. The files are read concurrently with
+        the streaming reader and merged so that a value from a later file overrides
+        the same option from an earlier one. Options set by parse_args() or an
+        earlier parse_config() call are left alone.
+
+        A required option missing from a section is only an error if no file sets
+        it. Use option_source() to find out which file set an option.'''
+
+        import concurrent.futures
+
+        files = _expand_config_sources(sources)
+
+        if len(files) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                parsers = list(executor.map(_stream_config_file, files))
+        else:
+            parsers = [_stream_config_file(filename) for filename in files]
+
+        merged = {}
+        merged_sources = {}
+        for config_file, parser in zip(files, parsers):
+            for key, (value, error) in _read_config(parser, config_file).items():
+                if error and key in merged and not parser.has_option(*key):
+                    continue # Missing here, but set by an earlier layer
+
+                merged[key] = (value, error)
+                merged_sources[key] = config_file
+
+        _apply_config(merged, None, merged_sources)
+        config_file_def['layers'] = files
+
+    def option_source(section, name):
+        '''Returns the path of the configuration file or the name of the environment variable that set an option, or None.'''
+
+        return option_definitions[section][name].source
+
+    def _env_index(prefix):
+        '''Returns a dict mapping environment variable names to option definitions, built once per schema version and prefix.'''
+
+        if env_state['key'] != (schema_state['version'], prefix):
+            index = {}
+            for section in option_definitions:
+                for name, opt in option_definitions[section].items():
+                    if opt.cmd_only:
                         continue
 
-                    if name in option_definitions[section]:
-                        opt = option_definitions[section][name]
-
-                        try:
-                            if opt.type in adapters:
-                                setattr(getattr(options, section), name, adapters[opt.type](section, name))
-                            else:
-                                value = cp.get(section, name)
-                                setattr(getattr(options, section), name, opt.type(value))
-                        except ValueError as e:
-                            print(e)
-                            raise OptionsUserError('Could not parse configuration file {0}: section {1} option {2} must be of type {3}, not {4}'.format(config_file, section, name, opt.type.__name__, type(getattr(getattr(options, section), name))))
-                        except NoOptionError:
-                            if option_definitions[section][name].set_by or hasattr(option_definitions[section][name], 'default'):
-                                continue
-                            raise OptionsUserError('Could not parse configuration file {0}: section {1} option {2} was not found'.format(config_file, section, name))
-                        option_definitions[section][name].set_by = parse_config
+                    env_name = '_'.join(part for part in (prefix, section, name) if part).upper()
+                    if env_name in index:
+                        raise OptionsError('Options {0}.{1} and {2}.{3} both map to the environment variable {4}.'.format(index[env_name].section, index[env_name].name, section, name, env_name))
+                    index[env_name] = opt
 
-    def parse_args(argv):
-        '''Parses command line arguments and sets option values as well as the cmdargs list.'''
+            env_state['key'] = (schema_state['version'], prefix)
+            env_state['index'] = index
 
-        short_args = []
-        long_args = []
-        cmd_options = {}
+        return env_state['index']
+
+    def parse_env(prefix='', environ=None):
+        '''Sets option values from environment variables, if not already set by the parse_args() function.
+
+        The variable for option section.name is PREFIX_SECTION_NAME, or
+        SECTION_NAME with an empty prefix. For example, with prefix 'app',
+        APP_SERVER_PORT sets server.port. environ defaults to os.environ.'''
+
+        index = _env_index(prefix)
+        if environ is None:
+            environ = os.environ
+
+        for env_name, value in environ.items():
+            opt = index.get(env_name)
+            if opt is None or opt.set_by is not None:
+                continue
+
+            try:
+                value = _convert_option(opt, value)
+            except ValueError:
+                raise OptionsUserError('Could not parse environment variable {0}: option {1}.{2} must be of type {3}.'.format(env_name, opt.section, opt.name, opt.type.__name__))
+
+            _set_option(opt, value, parse_env, env_name)
 
+    def reload_config(config_file=None):
+        '''Re-reads a configuration file and applies only the options whose values changed.
+
+        Unlike parse_config(), options previously set from a configuration file are
+        read again. Options set by parse_args() or parse_env() keep precedence, and
+        options that disappeared from the file fall back to their defaults. Nothing
+        is applied if the file fails to parse.
+
+        If the file is one of the layers read by parse_configs(), all the layers are
+        read again and merged. Options set by another configuration file are left
+        alone.
+
+        Returns a dict mapping (section, name) to (old_value, new_value) for every
+        option that changed. old_value is None if the option was not set before.
+        '''
+
+        config_file = _config_file_path(config_file)
+
+        layers = config_file_def['layers']
+        files = layers if layers and config_file in layers else [config_file]
+        return _reload_parsed([(filename, _stream_config_file(filename)) for filename in files])
+
+    def _reload_parsed(layers):
+        '''Applies the options that changed in parsed configuration files, for reload_config() and reload_url().
+
+        layers is a list of (config_file, parser) pairs, where later files override
+        earlier ones.
+        '''
+
+        sources = set(config_file for config_file, _ in layers)
+
+        resolved = []
         for section in option_definitions:
             for name, opt in option_definitions[section].items():
-                if not opt.cmd_name and not opt.cmd_short_name:
+                if opt.cmd_only or opt.set_by is parse_args or opt.set_by is parse_env:
                     continue
+                if opt.set_by is parse_config and opt.source not in sources:
+                    continue # Set by a configuration file that is not reloaded
+
+                for config_file, parser in reversed(layers):
+                    if parser.has_option(section, name):
+                        resolved.append((opt, _config_value(parser, config_file, opt), config_file))
+                        break
+                else:
+                    if opt.default is NO_DEFAULT:
+                        raise OptionsUserError('Could not parse configuration file {0}: section {1} option {2} was not found'.format(layers[-1][0], section, name))
+                    resolved.append((opt, _default_value(opt), None))
+
+        changes = {}
+        for opt, value, source in resolved:
+            opt.set_by = parse_config if source else None
+            opt.source = source
+            _mark_resolved(opt)
+
+            if _type(value) is _Template:
+                _set_template(opt, value.raw) # Only evaluated again if it or its references changed
+                continue
+
+            _drop_template(opt)
+            section_obj = getattr(options, opt.section)
+
+            if hasattr(section_obj, opt.name):
+                old_value = getattr(section_obj, opt.name)
+                if old_value == value and _type(old_value) == _type(value):
+                    continue
+            else:
+                old_value = None
+
+            setattr(section_obj, opt.name, value)
+            _value_changed(opt)
+            changes[(opt.section, opt.name)] = (old_value, value)
+
+        changes.update(_interpolate())
+
+        if changes:
+            publish_snapshot()
+
+        return changes
+
+    def _http_source(url, cache_file, timeout):
+        source = http_sources.get(url)
+        if source is None:
+            source = http_sources[url] = _HTTPConfigSource(url, cache_file, timeout)
+        else:
+            source.cache_file = cache_file or source.cache_file
+            source.timeout = timeout
+        return source
+
+    def _parse_body(body, url):
+        _record_read(url, len(body))
+        return _read_config_stream(StringIO(body), url, _wanted_options())
+
+    def parse_url(url, cache_file=None, timeout=10.0):
+        '''Parses a configuration file served over HTTP, like parse_config().
+
+        Requests go through a pool of keep-alive connections and are conditional:
+        the ETag and Last-Modified headers of the previous response are sent back,
+        so that reload_url() skips parsing when the server answers 304 Not
+        Modified. If cache_file is given, the last configuration fetched is saved
+        to it and used when the server cannot be reached, e.g. to start while
+        offline. option_source() returns the URL for the options it set.'''
+
+        body, _ = _http_source(url, cache_file, timeout).fetch()
+        _apply_config(_read_config(_parse_body(body, url), url), url)
+
+    def reload_url(url, cache_file=None, timeout=10.0):
+        '''Fetches a configuration file served over HTTP again, like reload_config(), and returns the changes.
+
+        Nothing is parsed if the configuration did not change since it was last
+        fetched, and {} is returned.
+        '''
+
+        body, changed = _http_source(url, cache_file, timeout).fetch()
+        if not changed:
+            return {}
+
+        return _reload_parsed([(url, _parse_body(body, url))])
+
+    def watch_config(config_file=None, interval=1.0, on_change=None, on_error=None):
+        '''Starts a background thread that calls reload_config() whenever the configuration file changes.
+
+        on_change(changes) is called with the result of reload_config() when at
+        least one option changed. on_error(exception) is called if the file could
+        not be reloaded; by default the error is printed. Returns the started
+        ConfigWatcher; call its stop() method to stop watching.
+        '''
+
+        config_file = _config_file_path(config_file)
+
+        from configparser import Error as ConfigParserError
+
+        def reload():
+            try:
+                changes = reload_config(config_file)
+            except (OptionsUserError, OSError, ConfigParserError) as e:
+                (on_error or print_func)(e)
+                return
+
+            if changes and on_change:
+                on_change(changes)
+
+        watcher = _config_watcher_class()(config_file, reload, interval)
+        watcher.start()
+        return watcher
+
+    def compile_schema(freeze=False):
+        '''Builds the command line lookup tables used by parse_args().
+
+        parse_args() compiles the schema on demand and define_opt() discards the
+        compiled tables, so calling this is optional. Pass freeze=True to make any
+        later define_opt() call raise an OptionsError instead.
+        '''
+
+        long_opts = {}
+        short_opts = {}
+
+        for section in option_definitions:
+            for name, opt in option_definitions[section].items():
+                takes_value = opt.type != bool
 
                 if opt.cmd_name:
-                    if opt.type == bool:
-                        long_args.append(opt.cmd_name)
-                    else:
-                        long_args.append('{0}='.format(opt.cmd_name))
-                    cmd_options['--{0}'.format(opt.cmd_name)] = opt
+                    long_opts[opt.cmd_name] = (opt, takes_value)
 
                 if opt.cmd_short_name:
-                    if opt.type == bool:
-                        short_args.append(opt.cmd_short_name)
-                    else:
-                        short_args.append('{0}:'.format(opt.cmd_short_name))
-                    cmd_options['-{0}'.format(opt.cmd_short_name)] = opt
+                    short_opts[opt.cmd_short_name] = (opt, takes_value)
 
-        try:
-            opts, args = getopt.getopt(argv, ''.join(short_args), long_args)
-        except getopt.GetoptError as err:
-            raise OptionsUserError(err)
+        schema_state['compiled'] = (long_opts, short_opts)
+        schema_state['frozen'] = schema_state['frozen'] or freeze
 
-        # Empty a non-local scope list, in case parse_args is called twice
-        if len(cmdargs) > 0:
-            [cmdargs.pop() for _ in range(len(cmdargs))]
+        return schema_state['compiled']
 
-        for arg in args:
-            cmdargs.append(arg)
+    def _match_long(long_opts, name):
+        '''Finds a long option by its full name or a unique prefix of it, like getopt does.'''
+
+        if name in long_opts:
+            return long_opts[name]
+
+        possibilities = [n for n in long_opts if n.startswith(name)]
+        if not possibilities:
+            raise OptionsUserError('option --{0} not recognized'.format(name))
+        if len(possibilities) > 1:
+            raise OptionsUserError('option --{0} not a unique prefix'.format(name))
 
-        for key, val in opts:
-            if key in cmd_options:
-                opt = cmd_options[key]
-                if opt.is_help:
+        return long_opts[possibilities[0]]
+
+    def _match_argv(argv, long_opts, short_opts):
+        '''Splits argv into (option definition, value) pairs and positional arguments.
+
+        Follows getopt.getopt() semantics: option processing stops at the first
+        non-option argument or at "--".
+        '''
+
+        matched = []
+        i, n = 0, len(argv)
+
+        while i < n:
+            arg = argv[i]
+
+            if arg == '--':
+                i += 1
+                break
+
+            if arg[:1] != '-' or arg == '-':
+                break
+
+            i += 1
+
+            if arg[1] == '-':
+                name, eq, val = arg[2:].partition('=')
+                opt, takes_value = _match_long(long_opts, name)
+
+                if takes_value:
+                    if not eq:
+                        if i >= n:
+                            raise OptionsUserError('option --{0} requires argument'.format(name))
+                        val = argv[i]
+                        i += 1
+                elif eq:
+                    raise OptionsUserError('option --{0} must not have an argument'.format(name))
+
+                matched.append((opt, val))
+                continue
+
+            j, chars = 1, len(arg)
+            while j < chars:
+                c = arg[j]
+                j += 1
+
+                if c not in short_opts:
+                    raise OptionsUserError('option -{0} not recognized'.format(c))
+
+                opt, takes_value = short_opts[c]
+                if not takes_value:
+                    matched.append((opt, ''))
+                    continue
+
+                if j < chars:
+                    val = arg[j:]
+                elif i < n:
+                    val = argv[i]
+                    i += 1
+                else:
+                    raise OptionsUserError('option -{0} requires argument'.format(c))
+
+                matched.append((opt, val))
+                break
+
+        return matched, argv[i:]
+
+    def parse_args(argv):
+        '''Parses command line arguments and sets option values as well as the cmdargs list.'''
+
+        long_opts, short_opts = schema_state['compiled'] or compile_schema()
+        opts, args = _match_argv(argv, long_opts, short_opts)
+
+        if command_state['commands']:
+            if not args:
+                if any(opt.is_help for opt, val in opts):
                     print_func(usage())
                     sys.exit(0)
+                raise OptionsUserError('A command is required: {0}.'.format(', '.join(command_state['commands'])))
 
-                if opt.type == bool:
-                    setattr(getattr(options, opt.section), opt.name, True)
-                else:
-                    try:
-                        setattr(getattr(options, opt.section), opt.name, opt.type(val))
-                    except ValueError:
-                        raise OptionsUserError('Could not parse command line option {0}: it must be of type {1}.'.format(opt.name, opt.type.__name__))
-                option_definitions[opt.section][opt.name].set_by = parse_args
+            _load_command(args[0])
+
+            # Match the rest against the global and the command's options
+            long_opts, short_opts = schema_state['compiled'] or compile_schema()
+            command_opts, args = _match_argv(args[1:], long_opts, short_opts)
+            opts.extend(command_opts)
+
+        # Empty the non-local scope list in place, in case parse_args is called twice
+        del cmdargs[:]
+        args_state['buffer'] = []
+
+        if cmdarg_defs['response_files'] or cmdarg_defs['stdin']:
+            args_state['iter'] = _stream_args(args)
+        else:
+            args_state['iter'] = None
+            cmdargs.extend(args)
+
+        for opt, val in opts:
+            if opt.is_help:
+                print_func(usage())
+                sys.exit(0)
+
+            if opt.type == bool:
+                val = True
             else:
-                raise OptionsUserError('Unknown command line parameter {0}.'.format(key))
+                try:
+                    val = _convert_option(opt, val)
+                except ValueError:
+                    raise OptionsUserError('Could not parse command line option {0}: it must be of type {1}.'.format(opt.name, opt.type.__name__))
+            _set_option(opt, val, parse_args)
 
         if config_file_def['section'] and hasattr(getattr(options, config_file_def['section']), config_file_def['optname']):
             config_file_def['filename'] = getattr(getattr(options, config_file_def['section']), config_file_def['optname'])
 
-    def init_options(argv=None, config_file=None):
+    def _stream_args(args):
+        '''Returns an iterator over positional arguments, with response files and standard input read lazily.'''
+
+        response_files = cmdarg_defs['response_files']
+        is_response_file = lambda arg: response_files and len(arg) > 1 and arg[0] == '@' and arg[1] != '@'
+
+        for arg in args:
+            if is_response_file(arg) and arg != '@-' and not os.path.isfile(arg[1:]):
+                raise OptionsUserError('Response file {0} does not exist.'.format(arg[1:]))
+
+        def stream():
+            if not args and cmdarg_defs['stdin']:
+                for line in sys.stdin:
+                    line = line.rstrip('\r\n')
+                    if line:
+                        yield line
+                return
+
+            for arg in args:
+                if response_files and arg[:2] == '@@':
+                    yield arg[1:]
+                elif not is_response_file(arg):
+                    yield arg
+                else:
+                    fp = sys.stdin if arg == '@-' else open(arg[1:], 'r', encoding=sys.getfilesystemencoding(), errors='surrogateescape')
+                    try:
+                        for line in fp:
+                            line = line.rstrip('\r\n')
+                            if line:
+                                yield line
+                    finally:
+                        if fp is not sys.stdin:
+                            fp.close()
+
+        return stream()
+
+    def iter_args():
+        '''Returns an iterator over the positional arguments of the last parse_args() call.
+
+        With define_args(response_files=True) or define_args(stdin=True), the
+        arguments are read as the iterator is consumed, and can only be iterated
+        over once. Otherwise this iterates over cmdargs.
+        '''
+
+        if args_state['iter'] is None:
+            return iter(cmdargs)
+
+        def consume():
+            buffer = args_state['buffer']
+            while buffer:
+                yield buffer.pop(0)
+            for arg in args_state['iter']:
+                yield arg
+
+        return consume()
+
+    def _count_args(limit):
+        '''Returns the number of positional arguments, reading at most limit of them ahead if they are streamed.'''
+
+        if args_state['iter'] is None:
+            return len(cmdargs)
+
+        buffer = args_state['buffer']
+        if len(buffer) < limit:
+            for arg in args_state['iter']:
+                buffer.append(arg)
+                if len(buffer) >= limit:
+                    break
+        return len(buffer)
+
+    def define_command(name, loader, help=None):
+        '''Defines a git-style subcommand.
+
+        Once a command is defined, the first argument after the global options
+        must be a command name. parse_args() then calls loader() for the chosen
+        command only, which defines that command's options with define_opt() and
+        optionally its arguments with define_args(). Options defined outside of a
+        loader are global and shared by all commands.
+        '''
+
+        if not isinstance(name, str) or not _is_name(name, _LOWERCASE + _DIGITS, _LOWERCASE + _DIGITS + '-'):
+            raise OptionsError('{0} is not a valid command name. It must contain only lowercase letters, numbers and dashes.'.format(name))
+
+        if name in command_state['commands']:
+            raise OptionsError('Command {0} is already defined.'.format(name))
+
+        command_state['commands'][name] = (loader, help)
+        schema_state['version'] += 1
+
+    def _load_command(name):
+        if name not in command_state['commands']:
+            raise OptionsUserError('Unknown command {0}. Commands are: {1}.'.format(name, ', '.join(command_state['commands'])))
+
+        command_state['selected'] = name
+        if name in command_state['loaded']:
+            return
+
+        command_state['loading'] = name
+        try:
+            command_state['commands'][name][0]()
+        finally:
+            command_state['loading'] = None
+        command_state['loaded'].add(name)
+
+    def get_command():
+        '''Returns the name of the command chosen on the command line, or None.'''
+
+        return command_state['selected']
+
+    class PendingOptionObject(OptionObject):
+        '''A section whose values have not been resolved yet by a lazy init_options().
+
+        Reading a value that is not set yet resolves all options first.
+        '''
+
+        def __getattr__(self, name):
+            if name.startswith('__'):
+                raise AttributeError(name)
+
+            _resolve_pending()
+            return object.__getattribute__(self, name)
+
+    def _resolve_pending():
+        '''Runs the resolution deferred by init_options(lazy=True), if any.'''
+
+        with lazy_state['lock']:
+            pending = lazy_state['pending']
+            if pending is None:
+                return
+
+            lazy_state['pending'] = None
+            try:
+                pending()
+            finally:
+                for section in option_definitions:
+                    getattr(options, section).__class__ = OptionObject
+
+    def _exit_with_usage(error):
+        print_func(error)
+        print_func('')
+        print_func(usage())
+        sys.exit(os.EX_USAGE)
+
+    def init_options(argv=None, config_file=None, cache_file=None, streaming=False, config_sources=None, lazy=False, stats=False, on_phase=None, env_prefix=None, compiled=None):
         """Shortcut method for initializing all the options.
 
         Uses no configuration file unless a command line option has been defined
-        as is_config_file=True.
+        as is_config_file=True. See parse_config() for cache_file and streaming.
+        If config_sources is given, those files are read with parse_configs() as
+        layers on top of the configuration file, which is then read with them:
+        cache_file and streaming do not apply.
+
+        If env_prefix is not None, options are also read from environment
+        variables with parse_env(env_prefix). They take precedence over
+        configuration files, but not over the command line.
+
+        If compiled is given, option values are loaded from that file, written by
+        compile_options(), instead of the environment, configuration files and
+        defaults. The command line still takes precedence.
+
+        If lazy is True, only the command line is parsed right away. Configuration
+        files, defaults and verification are deferred until a value that is not set
+        on the command line is read, or verify_all_options() is called.
+
+        If stats is True, returns an (options, InitStats) tuple instead of just
+        options. on_phase(phase, seconds) is called after each phase completes.
+        Nothing is timed unless one of them is used.
         """
 
         if argv is None:
             argv = sys.argv[1:]
 
-        try:
-            parse_args(argv)
-            if config_file or config_file_def['filename']:
-                parse_config(config_file)
+        init_stats = InitStats() if stats or on_phase else None
+
+        def run_phase(phase, func, *args):
+            if init_stats is None:
+                return func(*args)
 
-            set_defaults()
-            verify_all_options()
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                init_stats.phases[phase] = elapsed
+                if on_phase:
+                    on_phase(phase, elapsed)
 
-            return options
+        try:
+            run_phase('parse_args', parse_args, argv)
         except OptionsUserError as e:
-            print_func(e)
-            print_func('')
-            print_func(usage())
-            sys.exit(os.EX_USAGE)
+            _exit_with_usage(e)
 
-    def set_defaults():
-        '''Sets the default option values if they have not already been specified.'''
+        def resolve():
+            if init_stats is not None:
+                read_stats['files'] = init_stats.files_read
+
+            try:
+                _resolve_options(config_file, cache_file, streaming, config_sources, env_prefix, run_phase, init_stats, compiled)
+            except OptionsUserError as e:
+                _exit_with_usage(e)
+            finally:
+                read_stats['files'] = None
+
+        if not lazy:
+            resolve()
+        else:
+            with lazy_state['lock']:
+                lazy_state['pending'] = resolve
+                for section in option_definitions:
+                    getattr(options, section).__class__ = PendingOptionObject
+
+        return (options, init_stats) if stats else options
+
+    def _untimed(phase, func, *args):
+        return func(*args)
+
+    def _resolve_options(config_file, cache_file, streaming, config_sources, env_prefix, run_phase, init_stats=None, compiled=None):
+        '''Everything init_options() does after parsing the command line.'''
+
+        if compiled is not None:
+            run_phase('load_compiled', load_compiled, compiled)
+        else:
+            if env_prefix is not None:
+                run_phase('parse_env', parse_env, env_prefix)
+            base = config_file or config_file_def['filename']
+            if config_sources:
+                run_phase('parse_configs', parse_configs, ([base] if base else []) + list(config_sources))
+            elif base:
+                run_phase('parse_config', parse_config, config_file, cache_file, streaming)
+
+            run_phase('set_defaults', set_defaults)
+
+        if init_stats is not None:
+            init_stats.sources = _option_sources()
+
+        run_phase('verify_all_options', verify_all_options)
+        publish_snapshot()
+
+    async def async_init_options(argv=None, config_file=None, cache_file=None, streaming=False, config_sources=None, env_prefix=None, executor=None, compiled=None):
+        '''Coroutine version of init_options() for asyncio programs.
+
+        Environment variables and configuration files are read and parsed in
+        executor (the event loop's default executor if None), so the event loop
+        keeps running meanwhile. User errors are raised as OptionsUserError instead
+        of printing usage and exiting; its errors attribute lists every problem.
+        '''
+
+        import asyncio
+
+        if argv is None:
+            argv = sys.argv[1:]
+
+        parse_args(argv)
+        await asyncio.get_running_loop().run_in_executor(executor, _resolve_options, config_file, cache_file, streaming, config_sources, env_prefix, _untimed, None, compiled)
+
+        return options
+
+    async def async_parse_config(config_file=None, cache_file=None, streaming=False, executor=None):
+        '''Coroutine version of parse_config() that reads and parses the file in executor.'''
+
+        import asyncio
+
+        await asyncio.get_running_loop().run_in_executor(executor, parse_config, config_file, cache_file, streaming)
+
+    async def async_reload_config(config_file=None, executor=None):
+        '''Coroutine version of reload_config() that reads and parses the file in executor.'''
+
+        import asyncio
 
+        return await asyncio.get_running_loop().run_in_executor(executor, reload_config, config_file)
+
+    async def watch_config_async(config_file=None, interval=1.0, on_error=None):
+        '''Asynchronous iterator over the OptionsSnapshot published every time the configuration file changes.
+
+        The file is watched and reloaded in a background thread as with
+        watch_config(); on_error is passed on to it. The watcher stops when the
+        iteration does.
+        '''
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        snapshots = asyncio.Queue()
+
+        watcher = watch_config(config_file, interval, lambda changes: loop.call_soon_threadsafe(snapshots.put_nowait, get_snapshot()), on_error)
+        try:
+            while True:
+                yield await snapshots.get()
+        finally:
+            watcher.stop(timeout=0)
+
+    def _option_sources():
+        sources = {}
+        for section in option_definitions:
+            for name, opt in option_definitions[section].items():
+                if opt.set_by is parse_args:
+                    sources[(section, name)] = 'argv'
+                elif opt.set_by is parse_env:
+                    sources[(section, name)] = 'env'
+                elif opt.set_by is parse_config:
+                    sources[(section, name)] = opt.source
+                elif opt.default is not NO_DEFAULT:
+                    sources[(section, name)] = 'default'
+                else:
+                    sources[(section, name)] = None
+
+        return sources
+
+    def publish_snapshot():
+        '''Publishes an immutable snapshot of the current option values and returns it.
+
+        init_options() and reload_config() publish a snapshot once they have
+        finished updating the options object. Call this yourself when resolving
+        options with the individual parse_args()/parse_config()/set_defaults()
+        functions.
+        '''
+
+        _resolve_pending()
+
+        sections = []
+        for section in option_definitions:
+            section_obj = getattr(options, section)
+            values = [(name, getattr(section_obj, name)) for name in option_definitions[section] if hasattr(section_obj, name)]
+            sections.append((section, _make_snapshot(values)))
+
+        snapshot = _make_snapshot(sections)
+        snapshot_state['current'] = snapshot # A single reference swap: readers see the old or the new snapshot
+        return snapshot
+
+    def _namespace_layout():
+        '''Returns the snapshot classes and default values of namespaces, built once per schema version.'''
+
+        if namespace_state['version'] != schema_state['version']:
+            sections = []
+            for section in option_definitions:
+                opts = [opt for opt in option_definitions[section].values() if not opt.cmd_only]
+                names = tuple(opt.name for opt in opts)
+                sections.append((section, _snapshot_class(names), names, [opt.default for opt in opts],
+                    dict((name, i) for i, name in enumerate(names)), any(opt.default is NO_DEFAULT for opt in opts)))
+
+            namespace_state['layout'] = (_snapshot_class(tuple(layout[0] for layout in sections)), sections)
+            namespace_state['version'] = schema_state['version']
+
+        return namespace_state['layout']
+
+    def new_namespace(config_file=None, values=None):
+        '''Returns an OptionsSnapshot of option values resolved independently of the options object.
+
+        For processes that serve many tenants with the same options: define them
+        once, then create a namespace per tenant from its own configuration file
+        and/or values, a dict mapping section names to dicts of option values.
+        Names in values are case insensitive as in define_opt(). Strings in values
+        are converted like configuration file values, and take precedence over the
+        file. Defaults fill in the rest. cmd_only options are left out and no
+        interpolation is done.
+
+        A namespace only stores one __slots__ object per section, whose classes are
+        shared by all the namespaces of the schema. Raises an OptionsUserError
+        listing every problem.
+        '''
+
+        from configparser import Error as ConfigParserError
+
+        cls, sections = _namespace_layout()
+        overrides = {}
+        errors = []
+
+        if config_file is not None:
+            try:
+                parser = _stream_config_file(config_file)
+            except OSError as e:
+                raise OptionsUserError('Could not read configuration file {0}: {1}'.format(config_file, e.strerror or e))
+            except ConfigParserError as e:
+                raise OptionsUserError(str(e))
+
+            for (section, name), (value, error) in _read_config(parser, config_file, only_unset=False).items():
+                if error:
+                    errors.append(error)
+                else:
+                    overrides.setdefault(section, {})[name] = value
+
+        for section, section_values in (values or {}).items():
+            section = section.lower().strip()
+            for name, value in section_values.items():
+                name = name.lower().strip()
+                opt = option_definitions.get(section, {}).get(name)
+                if opt is None or opt.cmd_only:
+                    errors.append('Option {0}.{1} is not defined.'.format(section, name))
+                    continue
+
+                if isinstance(value, str):
+                    try:
+                        value = _convert(opt.type, value)
+                    except ValueError:
+                        errors.append('Option {0}.{1} must be of type {2}, not {3}'.format(section, name, opt.type.__name__, value))
+                        value = None
+                overrides.setdefault(section, {})[name] = value
+
+        namespace = object.__new__(cls)
+        for section, section_cls, names, defaults, index, required in sections:
+            section_values = list(defaults)
+
+            for name, value in overrides.get(section, {}).items():
+                section_values[index[name]] = value
+
+            if required:
+                errors.extend('Required option {0}.{1} was not specified.'.format(section, name)
+                    for name, value in zip(names, section_values) if value is NO_DEFAULT)
+
+            section_obj = object.__new__(section_cls)
+            for name, value in zip(names, section_values):
+                object.__setattr__(section_obj, name, value)
+            object.__setattr__(namespace, section, section_obj)
+
+        if errors:
+            raise OptionsUserError('\n'.join(errors), errors)
+
+        return namespace
+
+    def get_snapshot():
+        '''Returns the most recently published OptionsSnapshot, or None.
+
+        Threads should call this once per unit of work and read all the values they
+        need from the returned snapshot to get a consistent view without locking.
+        '''
+
+        return snapshot_state['current']
+
+    def publish_shared(name=None):
+        '''Publishes the current option values to shared memory and returns the segment name.
+
+        Worker processes can then call attach_shared(name) to read the values
+        without parsing anything. Calling this again publishes a new generation
+        under the same name: workers pick it up with SharedOptions.refresh(), and
+        keep reading the old one until they do.
+        '''
+
+        from multiprocessing import shared_memory
+
+        _resolve_pending()
+
+        if shared_state['control'] is None:
+            shared_state['control'] = shared_memory.SharedMemory(name, create=True, size=_SHARED_GENERATION.size)
+            _SHARED_GENERATION.pack_into(shared_state['control'].buf, 0, 0)
+        name = shared_state['control'].name
+        generation = _SHARED_GENERATION.unpack_from(shared_state['control'].buf, 0)[0] + 1
+
+        sections = []
         for section in option_definitions:
+            section_obj = getattr(options, section)
+            sections.append((section, [(opt_name, getattr(section_obj, opt_name)) for opt_name in option_definitions[section] if hasattr(section_obj, opt_name)]))
+
+        data = _pack_shared_options(sections, generation, _schema_fingerprint())
+        shm = shared_memory.SharedMemory('{0}_{1}'.format(name, generation), create=True, size=len(data))
+        shm.buf[:len(data)] = data
+
+        _SHARED_GENERATION.pack_into(shared_state['control'].buf, 0, generation)
+
+        if shared_state['data'] is not None:
+            shared_state['data'].close()
+            shared_state['data'].unlink()
+        shared_state['data'] = shm
+
+        return name
+
+    def unpublish_shared():
+        '''Removes the shared memory segments created by publish_shared().'''
+
+        for key in ('data', 'control'):
+            if shared_state[key] is not None:
+                shared_state[key].close()
+                shared_state[key].unlink()
+                shared_state[key] = None
+
+    def attach_shared(name):
+        '''Returns a read-only SharedOptions view of options published by publish_shared().
+
+        Raises an OptionsError if they were published with different option
+        definitions.
+        '''
+
+        shared = SharedOptions(name)
+        if shared.fingerprint != _schema_fingerprint():
+            raise OptionsError('Shared options {0} were published with different option definitions.'.format(name))
+        return shared
+
+    def compile_options(filename):
+        '''Writes the resolved option values to filename, for load_compiled() to restore without parsing anything.
+
+        Call it once options are resolved, e.g. after init_options() in a build
+        step. cmd_only options are not written. The file embeds the schema
+        fingerprint, and values that marshal cannot store are pickled.
+        '''
+
+        import pickle, tempfile
+
+        _resolve_pending()
+        _interpolate()
+
+        missing = ['{0}.{1}'.format(opt.section, opt.name) for opt in unresolved['required'] if not opt.cmd_only]
+        if missing:
+            raise OptionsError('Cannot compile options before they are resolved, missing: {0}.'.format(', '.join(missing)))
+
+        values = []
+        for section in option_definitions:
+            section_values = vars(getattr(options, section))
+            compiled_values = []
             for name, opt in option_definitions[section].items():
-                if not hasattr(option_definitions[section][name], 'default'):
+                if opt.cmd_only or name not in section_values:
                     continue
 
-                if option_definitions[section][name].set_by is not None:
+                value, pickled = section_values[name], False
+                if not _marshallable(value):
+                    value, pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL), True
+
+                compiled_values.append((name, value, pickled, opt.set_by.__name__ if opt.set_by else None, opt.source))
+            values.append((section, compiled_values))
+
+        # Templates are kept so that command line values still propagate
+        templates = [(key[0], key[1], raw) for key, raw in interpolation['templates'].items()
+            if option_definitions[key[0]][key[1]].set_by is not parse_args and not option_definitions[key[0]][key[1]].cmd_only]
+
+        payload = _COMPILED_MAGIC + marshal.dumps((_COMPILED_FORMAT, sys.implementation.cache_tag, _schema_fingerprint(), values, templates))
+
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix='.groper-compiled-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(payload)
+            os.replace(tmp_file, filename)
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+            raise
+
+    def load_compiled(filename):
+        '''Sets option values from a file written by compile_options().
+
+        Options set by parse_args() keep their values, so command line overrides
+        still apply, and options the file does not cover get their defaults. Raises an OptionsError if the file was compiled with
+        different option definitions or by another Python version.
+        '''
+
+        import pickle
+
+        with open(filename, 'rb') as fp:
+            data = fp.read()
+
+        try:
+            if data[:len(_COMPILED_MAGIC)] != _COMPILED_MAGIC:
+                raise ValueError(filename)
+            format, cache_tag, fingerprint, values, templates = marshal.loads(data[len(_COMPILED_MAGIC):])
+        except (ValueError, EOFError, TypeError):
+            raise OptionsError('{0} is not a compiled options file.'.format(filename))
+
+        if format != _COMPILED_FORMAT or cache_tag != sys.implementation.cache_tag or fingerprint != _schema_fingerprint():
+            raise OptionsError('Compiled options {0} are stale: they were compiled with different option definitions or another Python version.'.format(filename))
+
+        set_by_names = {func.__name__: func for func in (parse_args, parse_env, parse_config)}
+        required, defaults = unresolved['required'], unresolved['defaults']
+        for section, compiled_values in values:
+            section_obj = getattr(options, section)
+            definitions = option_definitions[section]
+
+            for name, value, pickled, set_by, source in compiled_values:
+                opt = definitions[name]
+                if opt.set_by is parse_args:
                     continue
 
-                default = getattr(option_definitions[section][name], 'default')
-                setattr(getattr(options, section), name, default)
+                setattr(section_obj, name, pickle.loads(value) if pickled else value)
+                opt.set_by = set_by_names.get(set_by)
+                opt.source = source
+                required.pop(opt, None)
+                defaults.pop(opt, None)
+
+        # Compiled values are already interpolated: only evaluate again what
+        # references options set on the command line
+        for section, name, raw in templates:
+            opt = option_definitions[section][name]
+            if opt.set_by is parse_args:
+                continue
+
+            _set_template(opt, raw, dirty=False)
+            for ref in interpolation['refs'][(section, name)]:
+                ref_opt = option_definitions.get(ref[0], {}).get(ref[1])
+                if ref_opt is not None and ref_opt.set_by is parse_args:
+                    interpolation['dirty'].add((section, name))
+
+        # cmd_only options are not compiled, nor are options left unset
+        set_defaults()
+        config_file_def['compiled'] = filename
+
+    def set_defaults():
+        '''Sets the default option values if they have not already been specified.'''
+
+        pending = unresolved['defaults']
+        unresolved['defaults'] = {}
+        for opt in pending:
+            _set_value(opt, _default_value(opt))
 
     def verify_all_options():
-        '''Raises an error if required options have not been specified by the user.'''
+        '''Raises an error if required options have not been specified by the user.
+
+        Interpolates the options defined with interpolate=True first.
+        '''
+
+        _resolve_pending()
+        _interpolate()
 
-        if config_file_def['section'] and not config_file_def['filename']:
+        if config_file_def['section'] and not config_file_def['filename'] and not config_file_def['compiled']:
             option = option_definitions[config_file_def['section']][config_file_def['optname']]
 
             if option.cmd_name:
@@ -420,42 +2837,225 @@ def OptionsMeta(print_func=None):
             raise OptionsUserError(error)
 
         errors = []
-        for section in option_definitions:
-            for name, opt in option_definitions[section].items():
-                if option_definitions[section][name].required:
-                    if not hasattr(getattr(options, section), name):
-
-                        if not option_definitions[section][name].cmd_only:
-                            final_words = ', and {0}.{1} could not be found in the config file.'.format(section, name)
-                        else:
-                            final_words = '.'
+        for opt in list(unresolved['required']):
+            if opt.name in vars(getattr(options, opt.section)):
+                _mark_resolved(opt) # Assigned directly on the options object
+                continue
+            if opt.command is not None and opt.command != command_state['selected']:
+                continue
+            if opt.is_config_file and config_file_def['compiled']:
+                continue
+
+            section, name = opt.section, opt.name
+            if not opt.cmd_only:
+                final_words = ', and {0}.{1} could not be found in the config file.'.format(section, name)
+            else:
+                final_words = '.'
 
-                        if option_definitions[section][name].cmd_name:
-                            error = 'Required command line option --{0} was not specified{1}'.format(option_definitions[section][name].cmd_name, final_words)
-                        elif option_definitions[section][name].cmd_short_name:
-                            error = 'Required command line option -{0} was not specified{1}'.format(option_definitions[section][name].cmd_short_name, final_words)
-                        else:
-                            error = 'Required option {0}.{1} was not specified in the config file.'.format(section, name,)
+            if opt.cmd_name:
+                error = 'Required command line option --{0} was not specified{1}'.format(opt.cmd_name, final_words)
+            elif opt.cmd_short_name:
+                error = 'Required command line option -{0} was not specified{1}'.format(opt.cmd_short_name, final_words)
+            else:
+                error = 'Required option {0}.{1} was not specified in the config file.'.format(section, name,)
 
-                        errors.append(error)
+            errors.append(error)
 
         if cmdarg_defs['count'] == -1:
             pass # zero args required
         elif cmdarg_defs['count'] == -2:
-            if len(cmdargs) < 1:
+            if _count_args(1) < 1:
                 errors.append('At least one <{0}> argument required.'.format(cmdarg_defs['args']))
         elif cmdarg_defs['args'] is not None:
-            if len(cmdargs) != cmdarg_defs['count']:
+            if _count_args(cmdarg_defs['count'] + 1) != cmdarg_defs['count']:
                 errors.append('Required arguments were not specified: {0}.'.format(' '.join(['<{0}>'.format(s) for s in cmdarg_defs['args']])))
 
         if len(errors) > 0:
-            raise OptionsUserError('\n'.join(errors))
+            raise OptionsUserError('\n'.join(errors), errors)
+
+    return OptionsScope(
+        (options, cmdargs, define_opt, define_args, parse_config, parse_args, set_defaults, verify_all_options, init_options, generate_sample_config, usage),
+        options=options,
+        cmdargs=cmdargs,
+        define_opt=define_opt,
+        define_args=define_args,
+        parse_config=parse_config,
+        parse_args=parse_args,
+        set_defaults=set_defaults,
+        verify_all_options=verify_all_options,
+        init_options=init_options,
+        generate_sample_config=generate_sample_config,
+        usage=usage,
+        define_opts=define_opts,
+        define_command=define_command,
+        validate_config=validate_config,
+        register_converter=register_converter,
+        compile_options=compile_options,
+        load_compiled=load_compiled,
+        get_command=get_command,
+        iter_args=iter_args,
+        compile_schema=compile_schema,
+        parse_configs=parse_configs,
+        parse_env=parse_env,
+        option_source=option_source,
+        reload_config=reload_config,
+        parse_url=parse_url,
+        reload_url=reload_url,
+        watch_config=watch_config,
+        publish_snapshot=publish_snapshot,
+        get_snapshot=get_snapshot,
+        new_namespace=new_namespace,
+        async_init_options=async_init_options,
+        async_parse_config=async_parse_config,
+        async_reload_config=async_reload_config,
+        watch_config_async=watch_config_async,
+        publish_shared=publish_shared,
+        unpublish_shared=unpublish_shared,
+        attach_shared=attach_shared,
+    )
+
+def _load_schema(schema):
+    '''Imports a schema module and returns the OptionsScope its options are defined in.
+
+    schema is a module name, optionally followed by :name of an OptionsScope in
+    that module. Without it, the module is expected to define its options with
+    the module-level functions of groper.
+    '''
+
+    import importlib
 
-    return options, cmdargs, define_opt, define_args, parse_config, parse_args, set_defaults, verify_all_options, init_options, generate_sample_config, usage
+    module_name, _, name = schema.partition(':')
+    module = importlib.import_module(module_name)
+    if not name:
+        return _scope
 
-options, cmdargs, define_opt, define_args, parse_config, parse_args, set_defaults, verify_all_options, init_options, generate_sample_config, usage = OptionsMeta()
+    scope = getattr(module, name, None)
+    if not isinstance(scope, OptionsScope):
+        raise OptionsError('{0} is not an OptionsScope.'.format(schema))
+    return scope
+
+# The schema loaded by a validate_files() worker process
+_validator = {
+    'schema': None,
+    'scope': None,
+}
+
+def _validate_chunk(schema, filenames):
+    if _validator['schema'] != schema:
+        _validator['scope'] = _load_schema(schema)
+        _validator['schema'] = schema
+
+    return [(filename, _validator['scope'].validate_config(filename)) for filename in filenames]
+
+def validate_files(schema, sources, max_workers=None):
+    '''Validates configuration files against the options defined by a schema module, in parallel processes.
+
+    schema is a module name as described in _load_schema(), imported once per
+    process. sources is a list of file paths, directories and glob patterns, as
+    for parse_configs(). Returns a dict mapping each file to the list of its
+    errors, which is empty if the file is valid, in the order of sources.
+    '''
 
-__all__ = ('options', 'cmdargs', 'define_opt', 'define_args', 'parse_config', 'parse_args', 'set_defaults', 'init_options', 'verify_all_options', 'generate_sample_config', 'usage', 'OptionsError', 'OptionsUserError', 'OptionsMeta',)
+    import concurrent.futures
+
+    scope = _load_schema(schema)
+    files = _expand_sources(sources)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    if max_workers == 1 or len(files) < 2:
+        return dict((filename, scope.validate_config(filename)) for filename in files)
+
+    # Large chunks amortize inter-process overhead, while several chunks per
+    # worker keep the load balanced
+    chunksize = max(1, min(256, len(files) // (max_workers * 4)))
+    chunks = [files[i:i + chunksize] for i in range(0, len(files), chunksize)]
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        for chunk_results in executor.map(_validate_chunk, [schema] * len(chunks), chunks):
+            results.update(chunk_results)
+    return results
+
+def _main(argv):
+    '''The python -m groper command line. Returns the exit status.'''
+
+    cli = OptionsMeta(lambda s: print(s, file=sys.stderr))
+    cli.define_opt('main', 'help', type=bool, cmd_name='help', cmd_short_name='h', is_help=True)
+
+    def load_validate():
+        cli.define_opt('validate', 'schema', cmd_name='schema', cmd_short_name='s')
+        cli.define_opt('validate', 'jobs', type=int, cmd_name='jobs', cmd_short_name='j', default=None)
+        cli.define_opt('validate', 'format', cmd_name='format', default='json')
+        cli.define_args((-2, 'config'), response_files=True)
+
+    cli.define_command('validate', load_validate, help='Validate configuration files against the options of a schema module')
+
+    try:
+        cli.parse_args(argv)
+        cli.set_defaults()
+        cli.verify_all_options()
+        if cli.options.validate.format not in ('json', 'text'):
+            raise OptionsUserError('--format must be json or text.')
+    except OptionsUserError as e:
+        print(e, file=sys.stderr)
+        print('', file=sys.stderr)
+        print(cli.usage('python -m groper'), file=sys.stderr)
+        return os.EX_USAGE
+
+    try:
+        results = validate_files(cli.options.validate.schema, list(cli.iter_args()), cli.options.validate.jobs)
+    except (ImportError, OptionsError) as e:
+        print('Could not load schema {0}: {1}'.format(cli.options.validate.schema, e), file=sys.stderr)
+        return os.EX_USAGE
+
+    invalid = dict((filename, errors) for filename, errors in results.items() if errors)
+    if cli.options.validate.format == 'json':
+        import json
+        json.dump({'checked': len(results), 'invalid': len(invalid), 'errors': invalid}, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        for filename, errors in invalid.items():
+            for error in errors:
+                print('{0}: {1}'.format(filename, error.replace('\n', '\n    ')))
+        print('{0} files checked, {1} invalid.'.format(len(results), len(invalid)))
+
+    return 1 if invalid else 0
+
+
+_scope = OptionsMeta()
+options, cmdargs, define_opt, define_args, parse_config, parse_args, set_defaults, verify_all_options, init_options, generate_sample_config, usage = _scope
+define_opts = _scope.define_opts
+define_command = _scope.define_command
+register_converter = _scope.register_converter
+compile_options = _scope.compile_options
+load_compiled = _scope.load_compiled
+validate_config = _scope.validate_config
+get_command = _scope.get_command
+iter_args = _scope.iter_args
+compile_schema = _scope.compile_schema
+parse_configs = _scope.parse_configs
+parse_env = _scope.parse_env
+option_source = _scope.option_source
+reload_config = _scope.reload_config
+parse_url = _scope.parse_url
+reload_url = _scope.reload_url
+watch_config = _scope.watch_config
+publish_snapshot = _scope.publish_snapshot
+get_snapshot = _scope.get_snapshot
+new_namespace = _scope.new_namespace
+async_init_options = _scope.async_init_options
+async_parse_config = _scope.async_parse_config
+async_reload_config = _scope.async_reload_config
+watch_config_async = _scope.watch_config_async
+publish_shared = _scope.publish_shared
+unpublish_shared = _scope.unpublish_shared
+attach_shared = _scope.attach_shared
+
+__all__ = ('options', 'cmdargs', 'define_opt', 'define_args', 'parse_config', 'parse_args', 'set_defaults', 'init_options', 'verify_all_options', 'generate_sample_config', 'usage', 'define_opts', 'define_command', 'get_command', 'iter_args', 'register_converter', 'compile_options', 'load_compiled', 'validate_config', 'validate_files', 'compile_schema', 'parse_configs', 'parse_env', 'option_source', 'reload_config', 'parse_url', 'reload_url', 'watch_config', 'publish_snapshot', 'get_snapshot', 'new_namespace', 'async_init_options', 'async_parse_config', 'async_reload_config', 'watch_config_async', 'publish_shared', 'unpublish_shared', 'attach_shared', 'OptionsError', 'OptionsUserError', 'OptionsMeta', 'OptionsScope', 'OptionsSnapshot', 'InitStats', 'ListOf', 'SetOf', 'duration', 'byte_size', 'SharedOptions', 'ConfigWatcher',)
 
 __version__ = '0.4.0'
 
+if __name__ == '__main__':
+    # Run the groper module that schema modules import, not this __main__ copy
+    import groper
+    sys.exit(groper._main(sys.argv[1:]))
@@ -1,12 +1,18 @@
-import unittest, tempfile, os
-from groper import OptionsMeta, OptionsUserError, OptionsError
+import unittest, tempfile, os, sys, io, json, contextlib, subprocess
+from groper import OptionsMeta, OptionsUserError, OptionsError, ListOf, SetOf, duration, byte_size, validate_files, _main
 from configparser import RawConfigParser, NoOptionError
 
+def _read_shared_options(name):
+    from groper import SharedOptions
+    shared = SharedOptions(name)
+    return shared.generation, shared.sec.foo, shared.sec.bar
+
 class GroperTest(unittest.TestCase):
 
     def setUp(self):
+        self.scope = OptionsMeta(lambda s: None)
         self.options, self.cmdargs, self.define_opt, self.define_args, self.parse_config, self.parse_args,\
-            self.set_defaults, self.verify_all_options, self.init_options, self.generate_sample_config, self.usage = OptionsMeta(lambda s: None)
+            self.set_defaults, self.verify_all_options, self.init_options, self.generate_sample_config, self.usage = self.scope
 
     def test_define_opt(self):
         self.assertRaises(OptionsError, self.define_opt, '', '')
@@ -248,6 +254,1190 @@ class GroperTest(unittest.TestCase):
         self.assertEqual(self.options.sec.bar, -2)
         self.assertEqual(self.cmdargs, ['a', 'b', 'c'])
 
+    def test_compile_schema(self):
+        self.define_opt('sec', 'foo', cmd_name='foo', cmd_short_name='f', default='foo')
+        self.define_opt('sec', 'num', type=int, cmd_name='num', cmd_short_name='n', default=0)
+        self.define_opt('sec', 'flag', type=bool, cmd_name='flag', cmd_short_name='x')
+
+        self.parse_args(['-xn5', '--fo', 'prefix', 'a', '-f', 'b'])
+        self.assertEqual(self.options.sec.flag, True)
+        self.assertEqual(self.options.sec.num, 5)
+        self.assertEqual(self.options.sec.foo, 'prefix')
+        self.assertEqual(self.cmdargs, ['a', '-f', 'b'])
+
+        self.parse_args(['--num=7', '--', '--flag'])
+        self.assertEqual(self.options.sec.num, 7)
+        self.assertEqual(self.cmdargs, ['--flag'])
+
+        self.assertRaises(OptionsUserError, self.parse_args, ['--flag=yes'])
+        self.assertRaises(OptionsUserError, self.parse_args, ['--num'])
+        self.assertRaises(OptionsUserError, self.parse_args, ['-n'])
+        self.assertRaises(OptionsUserError, self.parse_args, ['-q'])
+        self.assertRaises(OptionsUserError, self.parse_args, ['--nope'])
+
+        # Defining an option invalidates the compiled tables
+        self.define_opt('sec', 'bar', cmd_name='bar', default='bar')
+        self.parse_args(['--bar=cmdbar'])
+        self.assertEqual(self.options.sec.bar, 'cmdbar')
+
+        # A frozen schema rejects new definitions
+        self.scope.compile_schema(freeze=True)
+        self.assertRaises(OptionsError, self.define_opt, 'sec', 'baz')
+
+    def _write_config(self, filename, conf):
+        with open(filename, 'wb') as fp:
+            fp.write('\n'.join([s.strip() for s in conf.split('\n')]).encode('utf-8'))
+
+    def test_reload_config(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self._write_config(filename, '''
+                [sec]
+                foo = foo1
+                bar = 1
+                baz = 1
+            ''')
+
+            self.define_opt('sec', 'foo')
+            self.define_opt('sec', 'bar', type=int, cmd_name='bar')
+            self.define_opt('sec', 'baz', type=int, default=0)
+
+            self.parse_args(['--bar=10'])
+            self.parse_config(filename)
+            self.set_defaults()
+
+            self._write_config(filename, '''
+                [sec]
+                foo = foo2
+                bar = 2
+            ''')
+
+            changes = self.scope.reload_config(filename)
+            self.assertEqual(changes, {('sec', 'foo'): ('foo1', 'foo2'), ('sec', 'baz'): (1, 0)})
+            self.assertEqual(self.options.sec.foo, 'foo2')
+            self.assertEqual(self.options.sec.bar, 10)
+            self.assertEqual(self.options.sec.baz, 0)
+            self.assertEqual(self.scope.reload_config(filename), {})
+
+            self._write_config(filename, '''
+                [sec]
+                baz = 5
+            ''')
+            self.assertRaises(OptionsUserError, self.scope.reload_config, filename)
+            self.assertEqual(self.options.sec.baz, 0)
+        finally:
+            os.unlink(filename)
+
+    def test_parse_url(self):
+        import threading, socket
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        served = {'body': b'[sec]\nfoo = foo1\nbar = 1\n', 'etag': '"v1"'}
+        requests = []
+        connections = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                connections.append(self.connection)
+
+            def do_GET(self):
+                requests.append((self.path, self.headers.get('If-None-Match')))
+                if self.headers.get('If-None-Match') == served['etag']:
+                    self.send_response(304)
+                    self.send_header('ETag', served['etag'])
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('ETag', served['etag'])
+                self.send_header('Content-Length', str(len(served['body'])))
+                self.end_headers()
+                self.wfile.write(served['body'])
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.handle_error = lambda request, client_address: None # Connections reset when the server is stopped
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        url = 'http://127.0.0.1:{0}/app.conf?env=test'.format(server.server_port)
+
+        tmpdir = tempfile.mkdtemp()
+        cache_file = os.path.join(tmpdir, 'app.conf.cache')
+        try:
+            self.define_opt('sec', 'foo')
+            self.define_opt('sec', 'bar', type=int)
+            self.define_opt('sec', 'baz', type=int, default=0)
+
+            self.scope.parse_url(url, cache_file=cache_file)
+            self.set_defaults()
+            self.verify_all_options()
+            self.assertEqual((self.options.sec.foo, self.options.sec.bar, self.options.sec.baz), ('foo1', 1, 0))
+            self.assertEqual(self.scope.option_source('sec', 'bar'), url)
+
+            # Not modified: nothing is parsed again
+            self.assertEqual(self.scope.reload_url(url), {})
+
+            served['body'], served['etag'] = b'[sec]\nfoo = foo1\nbar = 2\nbaz = 3\n', '"v2"'
+            self.assertEqual(self.scope.reload_url(url), {('sec', 'bar'): (1, 2), ('sec', 'baz'): (0, 3)})
+
+            self.assertEqual(requests, [('/app.conf?env=test', None), ('/app.conf?env=test', '"v1"'), ('/app.conf?env=test', '"v1"')])
+            self.assertEqual(len(connections), 1)
+
+            # The cache file is a valid configuration file
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'foo')
+            scope.define_opt('sec', 'bar', type=int)
+            scope.define_opt('sec', 'baz', type=int, default=0)
+            scope.parse_config(cache_file)
+            self.assertEqual(scope.options.sec.bar, 2)
+
+            # A cache file that cannot be written is skipped
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'bar', type=int)
+            scope.parse_url(url, cache_file=os.path.join(tmpdir, 'nonexistent', 'app.conf.cache'))
+            self.assertEqual(scope.options.sec.bar, 2)
+            self.assertEqual(os.listdir(tmpdir), ['app.conf.cache'])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            for connection in connections:
+                connection.shutdown(socket.SHUT_RDWR)
+
+        try:
+            # Offline start from the cache file
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'bar', type=int)
+            scope.parse_url(url, cache_file=cache_file, timeout=1.0)
+            self.assertEqual(scope.options.sec.bar, 2)
+            self.assertRaises(OptionsUserError, scope.reload_url, url)
+
+            scope = OptionsMeta(lambda s: None)
+            self.assertRaises(OptionsUserError, scope.parse_url, url, timeout=1.0)
+            self.assertRaises(OptionsError, scope.parse_url, 'ftp://example.com/app.conf')
+        finally:
+            os.unlink(cache_file)
+            os.rmdir(tmpdir)
+
+    def test_watch_config(self):
+        import threading
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self._write_config(filename, '''
+                [sec]
+                foo = foo1
+            ''')
+
+            self.define_opt('sec', 'foo')
+            self.parse_config(filename)
+
+            changed = threading.Event()
+            watcher = self.scope.watch_config(filename, interval=0.01, on_change=lambda changes: changed.set())
+            try:
+                self._write_config(filename, '''
+                    [sec]
+                    foo = foo22
+                ''')
+                self.assertTrue(changed.wait(5))
+                self.assertEqual(self.options.sec.foo, 'foo22')
+            finally:
+                watcher.stop()
+        finally:
+            os.unlink(filename)
+
+    def test_snapshot(self):
+        self.define_opt('sec', 'foo', cmd_name='foo', default='foo')
+        self.define_opt('sec', 'nop')
+        self.assertEqual(self.scope.get_snapshot(), None)
+
+        self.parse_args(['--foo=bar'])
+        self.set_defaults()
+        snapshot = self.scope.publish_snapshot()
+
+        self.assertTrue(self.scope.get_snapshot() is snapshot)
+        self.assertEqual(snapshot.sec.foo, 'bar')
+        self.assertTrue(not hasattr(snapshot.sec, 'nop'))
+        self.assertRaises(AttributeError, setattr, snapshot.sec, 'foo', 'baz')
+        self.assertRaises(AttributeError, setattr, snapshot, 'sec', None)
+
+        self.parse_args(['--foo=baz'])
+        self.assertEqual(snapshot.sec.foo, 'bar')
+        self.assertEqual(self.scope.publish_snapshot().sec.foo, 'baz')
+
+    def test_snapshot_concurrent_readers(self):
+        import threading
+        for name in ('a', 'b', 'c'):
+            self.define_opt('sec', name, type=int, cmd_name=name)
+
+        self.init_options(['--a=0', '--b=0', '--c=0'])
+
+        stop = threading.Event()
+        torn = []
+
+        def reader():
+            while not stop.is_set():
+                snapshot = self.scope.get_snapshot()
+                if not (snapshot.sec.a == snapshot.sec.b == snapshot.sec.c):
+                    torn.append((snapshot.sec.a, snapshot.sec.b, snapshot.sec.c))
+
+        readers = [threading.Thread(target=reader) for _ in range(8)]
+        for thread in readers:
+            thread.start()
+        try:
+            for i in range(1, 2000):
+                self.init_options(['--a={0}'.format(i), '--b={0}'.format(i), '--c={0}'.format(i)])
+        finally:
+            stop.set()
+            for thread in readers:
+                thread.join()
+
+        self.assertEqual(torn, [])
+        self.assertEqual(self.scope.get_snapshot().sec.c, 1999)
+
+    def test_namespaces(self):
+        self.define_opt('db', 'host', default='localhost')
+        self.define_opt('db', 'port', type=int)
+        self.define_opt('db', 'hosts', type=list, default=[])
+        self.define_opt('main', 'verbose', type=bool, cmd_name='verbose', cmd_only=True)
+
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self._write_config(filename, '''
+                [db]
+                host = db1
+                port = 5432
+                ''')
+
+            a = self.scope.new_namespace(config_file=filename)
+            b = self.scope.new_namespace(config_file=filename, values={'db': {'port': '6432', 'hosts': ['x']}})
+            c = self.scope.new_namespace(values={'DB': {'Port': 7}})
+
+            self.assertEqual((a.db.host, a.db.port, a.db.hosts), ('db1', 5432, []))
+            self.assertEqual((b.db.host, b.db.port, b.db.hosts), ('db1', 6432, ['x']))
+            self.assertEqual((c.db.host, c.db.port), ('localhost', 7))
+            self.assertTrue(type(a.db) is type(c.db))
+            self.assertTrue(not hasattr(a.main, 'verbose'))
+            self.assertRaises(AttributeError, setattr, a.db, 'port', 1)
+
+            # The options object itself is left untouched
+            self.assertTrue(not hasattr(self.options.db, 'port'))
+        finally:
+            os.unlink(filename)
+
+        with self.assertRaises(OptionsUserError) as cm:
+            self.scope.new_namespace(values={'db': {'port': 'x', 'user': 'me'}, 'main': {'verbose': True}})
+        self.assertEqual(cm.exception.errors, [
+            'Option db.port must be of type int, not x',
+            'Option db.user is not defined.',
+            'Option main.verbose is not defined.',
+        ])
+
+        self.assertRaises(OptionsUserError, self.scope.new_namespace)
+
+        self.define_opt('db', 'user', default='app')
+        self.assertEqual(self.scope.new_namespace(values={'db': {'port': 1}}).db.user, 'app')
+
+        # Strings are converted, not interpolated
+        self.assertEqual(self.scope.new_namespace(values={'db': {'port': '1', 'host': '${db.user}'}}).db.host, '${db.user}')
+
+    def test_config_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'app.conf')
+        cache_file = os.path.join(tmpdir, 'app.cache')
+        try:
+            self._write_config(filename, '''
+                [sec]
+                foo = foo1
+                bar = 1
+            ''')
+
+            def resolve(argv=(), schema=True):
+                scope = OptionsMeta(lambda s: None)
+                scope.define_opt('sec', 'foo', cmd_name='foo')
+                scope.define_opt('sec', 'bar', type=int if schema else float)
+                scope.parse_args(list(argv))
+                scope.parse_config(filename, cache_file)
+                return scope.options
+
+            self.assertEqual(resolve().sec.foo, 'foo1')
+            self.assertTrue(os.path.exists(cache_file))
+            mtime = os.stat(cache_file).st_mtime_ns
+
+            options = resolve(['--foo=cmdfoo'])
+            self.assertEqual(options.sec.foo, 'cmdfoo')
+            self.assertEqual(options.sec.bar, 1)
+            self.assertEqual(os.stat(cache_file).st_mtime_ns, mtime) # A hit does not rewrite the cache
+
+            options = resolve(schema=False)
+            self.assertTrue(isinstance(options.sec.bar, float))
+
+            self._write_config(filename, '''
+                [sec]
+                foo = foo22
+                bar = 2
+            ''')
+            self.assertEqual(resolve().sec.foo, 'foo22')
+
+            with open(cache_file, 'wb') as fp:
+                fp.write(b'garbage')
+            self.assertEqual(resolve().sec.bar, 2)
+
+            # A cache that cannot be written is skipped
+            cache_file = os.path.join(tmpdir, 'nonexistent', 'app.cache')
+            self.assertEqual(resolve().sec.bar, 2)
+            self.assertFalse(os.path.exists(os.path.dirname(cache_file)))
+        finally:
+            for name in os.listdir(tmpdir):
+                os.unlink(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+
+    def test_streaming_config(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+
+        def resolve(streaming):
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'foo')
+            scope.define_opt('sec', 'multi', default='')
+            scope.define_opt('sec', 'colon', type=int, default=0)
+            scope.define_opt('sec', 'inherited', type=bool, default=False)
+            scope.define_opt('sec', 'cmd', cmd_name='cmd', cmd_only=True, default='cmd')
+            scope.define_opt('other', 'foo', default='')
+            scope.parse_config(filename, streaming=streaming)
+            return scope.options
+
+        try:
+            with open(filename, 'w') as fp:
+                fp.write('\n'.join([
+                    '[DEFAULT]',
+                    'inherited = yes',
+                    '',
+                    '[unused]',
+                    'junk = 1',
+                    '    [sec]',
+                    'more junk: 2',
+                    '',
+                    '; comment',
+                    '[sec]',
+                    '# comment',
+                    'FOO = a = b',
+                    'multi = line1',
+                    '  line2',
+                    '',
+                    '  line3',
+                    '  # still a comment',
+                    'colon: 42',
+                    'cmd = ignored',
+                ]))
+
+            for streaming in (False, True):
+                options = resolve(streaming)
+                self.assertEqual(options.sec.foo, 'a = b')
+                self.assertEqual(options.sec.multi, 'line1\nline2\n\nline3')
+                self.assertEqual(options.sec.colon, 42)
+                self.assertEqual(options.sec.inherited, True)
+                self.assertTrue(not hasattr(options.sec, 'cmd'))
+                self.assertTrue(not hasattr(options, 'unused'))
+
+            for conf in ('foo = 1', '[sec]\nfoo', '[sec]\n= 1', '[a]\n[b]\n[a]', '[sec]\nfoo = 1\nFoo = 2', '[a]\njunk\n[sec]\nfoo = 1'):
+                with open(filename, 'w') as fp:
+                    fp.write(conf)
+                errors = []
+                for streaming in (False, True):
+                    try:
+                        resolve(streaming)
+                        errors.append(None)
+                    except Exception as e:
+                        errors.append(type(e))
+                self.assertEqual(errors[0], errors[1], conf)
+                self.assertTrue(errors[0] is not None, conf)
+        finally:
+            os.unlink(filename)
+
+    def test_parse_configs(self):
+        tmpdir = tempfile.mkdtemp()
+        confd = os.path.join(tmpdir, 'conf.d')
+        os.mkdir(confd)
+        base = os.path.join(tmpdir, 'base.conf')
+        try:
+            self._write_config(base, '''
+                [sec]
+                foo = base
+                bar = 1
+                baz = base
+            ''')
+            self._write_config(os.path.join(confd, '10-first.conf'), '''
+                [sec]
+                foo = first
+                bar = 2
+            ''')
+            self._write_config(os.path.join(confd, '20-second.conf'), '''
+                [sec]
+                bar = 3
+            ''')
+            self._write_config(os.path.join(confd, 'ignored.txt'), '''
+                [sec]
+                baz = ignored
+            ''')
+
+            self.define_opt('sec', 'foo')
+            self.define_opt('sec', 'bar', type=int, cmd_name='bar')
+            self.define_opt('sec', 'baz')
+            self.define_opt('sec', 'nop', default='nop')
+
+            self.parse_args([])
+            self.scope.parse_configs([base, os.path.join(confd, '*.conf')])
+            self.set_defaults()
+            self.verify_all_options()
+
+            self.assertEqual(self.options.sec.foo, 'first')
+            self.assertEqual(self.options.sec.bar, 3)
+            self.assertEqual(self.options.sec.baz, 'base')
+            self.assertEqual(self.scope.option_source('sec', 'foo'), os.path.join(confd, '10-first.conf'))
+            self.assertEqual(self.scope.option_source('sec', 'bar'), os.path.join(confd, '20-second.conf'))
+            self.assertEqual(self.scope.option_source('sec', 'baz'), base)
+            self.assertEqual(self.scope.option_source('sec', 'nop'), None)
+
+            # Reloading one of the layers merges all of them again
+            self._write_config(base, '''
+                [sec]
+                foo = base
+                bar = 1
+                baz = base2
+            ''')
+            self.assertEqual(self.scope.reload_config(base), {('sec', 'baz'): ('base', 'base2')})
+            self.assertEqual((self.options.sec.foo, self.options.sec.bar), ('first', 3))
+            self.assertEqual(self.scope.option_source('sec', 'bar'), os.path.join(confd, '20-second.conf'))
+
+            # Options set by a file that is not reloaded are left alone
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'foo', default='dflt')
+            scope.define_opt('sec', 'bar', type=int)
+            scope.define_opt('sec', 'baz', default='dflt')
+            scope.parse_config(os.path.join(confd, '20-second.conf'))
+            scope.parse_config(base)
+            self.assertEqual(scope.reload_config(base), {})
+            self.assertEqual(scope.options.sec.bar, 3)
+
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'foo')
+            scope.define_opt('sec', 'bar', type=int, cmd_name='bar')
+            scope.init_options(['--bar=10'], config_sources=[confd])
+            self.assertEqual(scope.options.sec.bar, 10)
+            self.assertEqual(scope.options.sec.foo, 'first')
+
+            # The fragments override the configuration file
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'foo')
+            scope.define_opt('sec', 'bar', type=int)
+            scope.define_opt('sec', 'baz')
+            scope.init_options([], config_file=base, config_sources=[os.path.join(confd, '*.conf')])
+            self.assertEqual((scope.options.sec.foo, scope.options.sec.bar, scope.options.sec.baz), ('first', 3, 'base2'))
+
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'baz')
+            self.assertRaises(OptionsUserError, scope.parse_configs, [os.path.join(confd, '*.conf')])
+            self.assertRaises(OptionsUserError, scope.parse_configs, [os.path.join(tmpdir, 'missing.conf')])
+        finally:
+            for name in os.listdir(confd):
+                os.unlink(os.path.join(confd, name))
+            os.rmdir(confd)
+            os.unlink(base)
+            os.rmdir(tmpdir)
+
+    def test_lazy_init_options(self):
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'app.conf')
+        try:
+            self.define_opt('sec', 'foo', cmd_name='foo')
+            self.define_opt('sec', 'bar', type=int)
+            self.define_opt('sec', 'baz', default='baz')
+
+            self.init_options(['--foo=cmdfoo'], config_file=filename, lazy=True)
+            self.assertEqual(self.options.sec.foo, 'cmdfoo') # Does not need the config file, which does not exist yet
+
+            self._write_config(filename, '''
+                [sec]
+                bar = 5
+            ''')
+            self.assertEqual(self.options.sec.bar, 5)
+            self.assertEqual(self.options.sec.baz, 'baz')
+            self.assertEqual(self.scope.get_snapshot().sec.bar, 5)
+            self.assertEqual(type(self.options.sec).__name__, 'OptionObject')
+
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'foo')
+            scope.define_opt('sec', 'nop')
+            scope.init_options([], config_file=filename, lazy=True)
+            self.assertRaises(SystemExit, getattr, scope.options.sec, 'foo')
+
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'nop')
+            scope.init_options([], config_file=filename, lazy=True)
+            self.assertRaises(SystemExit, scope.verify_all_options)
+        finally:
+            os.unlink(filename)
+            os.rmdir(tmpdir)
+
+    def test_define_opts(self):
+        self.scope.define_opts([
+            {'section': 'sec', 'name': 'foo', 'cmd_name': 'foo', 'default': 'foo'},
+            ('sec', 'bar', {'type': int, 'default': -1}),
+            ('other', 'baz'),
+        ])
+        self.scope.define_opts({('sec', 'hum'): {'type': bool}})
+
+        self.parse_args(['--foo=cmdfoo'])
+        self.set_defaults()
+        self.assertEqual(self.options.sec.foo, 'cmdfoo')
+        self.assertEqual(self.options.sec.bar, -1)
+        self.assertEqual(self.options.sec.hum, False)
+        self.assertRaises(OptionsUserError, self.verify_all_options)
+
+        try:
+            self.scope.define_opts([
+                ('sec', 'new1'),
+                ('sec', 'foo'),
+                ('sec', '-bad'),
+                ('sec', 'new2', {'cmd_only': True}),
+                ('sec', 'new3'),
+                ('sec', 'new3'),
+                ('sec', 'new4', {'is_help': True}),
+            ])
+            self.fail('define_opts() accepted invalid options')
+        except OptionsError as e:
+            self.assertEqual(len(str(e).split('\n')), 5)
+
+        self.define_opt('sec', 'new1') # Nothing was defined by the failed call
+
+    def test_import_time(self):
+        # Modules that importing groper may import, and the time it may spend importing them
+        budget_modules = set(['struct', '_struct'])
+        budget_us = 5000
+
+        def imported(code):
+            stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+
+            modules = {}
+            for line in stderr.splitlines():
+                fields = line.partition('import time:')[2].split('|')
+                if len(fields) == 3 and fields[0].strip().isdigit():
+                    modules[fields[2].strip()] = int(fields[0])
+            return modules
+
+        startup = imported('pass')
+        modules = imported('import groper')
+        dependencies = set(modules) - set(startup) - set(['groper'])
+
+        self.assertEqual(sorted(dependencies - budget_modules), [])
+        self.assertLess(sum(modules[name] for name in dependencies), budget_us)
+
+        # Parsing a command line does not need more
+        modules = imported('import groper; groper.define_opt("main", "verbose", type=bool, cmd_name="verbose"); groper.init_options(["--verbose"]); groper.usage()')
+        self.assertEqual(sorted(set(modules) - set(startup) - set(['groper']) - budget_modules), [])
+
+    def test_init_stats(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self._write_config(filename, '''
+                [sec]
+                foo = conffoo
+            ''')
+
+            self.define_opt('sec', 'foo')
+            self.define_opt('sec', 'bar', cmd_name='bar')
+            self.define_opt('sec', 'baz', default='baz')
+            self.define_opt('sec', 'nop', default=None)
+
+            phases = []
+            options, stats = self.init_options(['--bar=cmdbar'], config_file=filename, stats=True, on_phase=lambda phase, seconds: phases.append(phase))
+
+            self.assertTrue(options is self.options)
+            self.assertEqual(phases, ['parse_args', 'parse_config', 'set_defaults', 'verify_all_options'])
+            self.assertEqual(list(stats.phases), phases)
+            self.assertTrue(stats.total_time >= 0)
+            self.assertEqual(stats.files_read, [(os.path.abspath(filename), os.path.getsize(filename))])
+            self.assertEqual(stats.bytes_read, os.path.getsize(filename))
+            self.assertEqual(stats.sources[('sec', 'foo')], os.path.abspath(filename))
+            self.assertEqual(stats.sources[('sec', 'bar')], 'argv')
+            self.assertEqual(stats.sources[('sec', 'baz')], 'default')
+            self.assertEqual(stats.counts, {'argv': 1, 'env': 0, 'config': 1, 'default': 2, 'unset': 0})
+        finally:
+            os.unlink(filename)
+
+    def test_cached_output(self):
+        from io import StringIO
+
+        self.define_opt('sec', 'foo', cmd_name='foo', default='foo')
+        usage = self.usage('prog')
+        sample = self.generate_sample_config()
+        self.assertTrue(self.usage('prog') is usage)
+        self.assertTrue(self.generate_sample_config() is sample)
+
+        fp = StringIO()
+        self.generate_sample_config(fp)
+        self.assertEqual(fp.getvalue(), sample)
+
+        self.define_opt('sec', 'bar', cmd_name='bar', default='bar')
+        self.assertTrue('--bar' in self.usage('prog'))
+        self.assertTrue('bar = bar' in self.generate_sample_config())
+
+        self.define_args((-1, 'file'))
+        self.assertTrue('[file] ...' in self.usage('prog'))
+
+    def test_shared_options(self):
+        import multiprocessing
+
+        self.define_opt('sec', 'foo', cmd_name='foo')
+        self.define_opt('sec', 'bar', type=int, default=1)
+        self.define_opt('sec', 'baz', type=float, default=0.5)
+        self.define_opt('sec', 'big', type=int, default=2 ** 70)
+        self.define_opt('sec', 'lst', type=list, default=['a', 'b'])
+        self.define_opt('sec', 'nop')
+
+        self.parse_args(['--foo=' + 'fõõ' * 1000])
+        self.set_defaults()
+        name = self.scope.publish_shared()
+        try:
+            shared = self.scope.attach_shared(name)
+            self.assertEqual(shared.generation, 1)
+            self.assertEqual(shared.sec.foo, 'fõõ' * 1000)
+            self.assertEqual(shared.sec.bar, 1)
+            self.assertEqual(shared.sec.baz, 0.5)
+            self.assertEqual(shared.sec.big, 2 ** 70)
+            self.assertEqual(shared.sec.lst, ['a', 'b'])
+            self.assertTrue(not hasattr(shared.sec, 'nop'))
+            self.assertRaises(AttributeError, setattr, shared.sec, 'bar', 2)
+            self.assertFalse(shared.refresh())
+
+            section = shared.sec
+            self.parse_args(['--foo=new'])
+            self.assertEqual(self.scope.publish_shared(), name)
+            self.assertEqual(section.foo, 'fõõ' * 1000) # Still reading the old generation
+            self.assertTrue(shared.refresh())
+            self.assertEqual(shared.generation, 2)
+            self.assertEqual(shared.sec.foo, 'new')
+
+            with multiprocessing.get_context('spawn').Pool(1) as pool:
+                self.assertEqual(pool.apply(_read_shared_options, (name,)), (2, 'new', 1))
+
+            scope = OptionsMeta(lambda s: None)
+            scope.define_opt('sec', 'foo')
+            self.assertRaises(OptionsError, scope.attach_shared, name)
+            del shared, section
+        finally:
+            self.scope.unpublish_shared()
+
+    def test_parse_env(self):
+        self.define_opt('server', 'port', type=int, cmd_name='port')
+        self.define_opt('server', 'host', default='localhost')
+        self.define_opt('server', 'debug', type=bool)
+        self.define_opt('server', 'config', cmd_name='config', is_config_file=True, default='/nonexistent')
+
+        environ = {'APP_SERVER_PORT': '8080', 'APP_SERVER_DEBUG': 'yes', 'APP_SERVER_CONFIG': '/etc/other', 'SERVER_HOST': 'ignored'}
+        self.parse_args([])
+        self.scope.parse_env('app', environ)
+        self.set_defaults()
+
+        self.assertEqual(self.options.server.port, 8080)
+        self.assertEqual(self.options.server.debug, True)
+        self.assertEqual(self.options.server.host, 'localhost')
+        self.assertEqual(self.scope.option_source('server', 'port'), 'APP_SERVER_PORT')
+        self.assertEqual(self.options.server.config, '/nonexistent') # cmd_only options are not read from the environment
+
+        scope = OptionsMeta(lambda s: None)
+        scope.define_opt('server', 'port', type=int, cmd_name='port')
+        scope.parse_args(['--port=1'])
+        scope.parse_env('app', environ)
+        self.assertEqual(scope.options.server.port, 1)
+
+        scope = OptionsMeta(lambda s: None)
+        scope.define_opt('server', 'port', type=int)
+        self.assertRaises(OptionsUserError, scope.parse_env, 'app', {'APP_SERVER_PORT': 'x'})
+
+        scope.define_opt('server_port', 'x')
+        scope.define_opt('server', 'port_x')
+        self.assertRaises(OptionsError, scope.parse_env, 'app', environ)
+
+    def test_async_init_options(self):
+        import asyncio, time
+
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as fp:
+            for section in range(20):
+                fp.write('[sec{0}]\n'.format(section))
+                for i in range(2000):
+                    fp.write('opt{0} = {0}\n'.format(i))
+
+        for section in range(20):
+            self.scope.define_opts([('sec{0}'.format(section), 'opt{0}'.format(i), {'type': int}) for i in range(2000)])
+        self.define_opt('cmd', 'nop', cmd_name='nop')
+
+        async def main():
+            gaps = []
+
+            async def probe():
+                last = time.perf_counter()
+                while True:
+                    await asyncio.sleep(0.001)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+
+            probe_task = asyncio.ensure_future(probe())
+            await asyncio.sleep(0.01)
+            try:
+                start = time.perf_counter()
+                options = await self.scope.async_init_options(['--nop=x'], config_file=filename, streaming=True)
+                elapsed = time.perf_counter() - start
+            finally:
+                probe_task.cancel()
+
+            with self.assertRaises(OptionsUserError) as cm:
+                await OptionsMeta(lambda s: None).async_init_options([], config_file=filename + '.missing')
+            self.assertEqual(len(cm.exception.errors), 1)
+
+            return options, elapsed, max(gaps)
+
+        options, elapsed, max_gap = asyncio.run(main())
+        os.unlink(filename)
+
+        self.assertEqual(options.sec19.opt1999, 1999)
+        self.assertEqual(self.scope.get_snapshot().sec0.opt5, 5)
+        self.assertTrue(max_gap < elapsed / 2, (max_gap, elapsed)) # The loop kept running while the file was parsed
+
+    def test_watch_config_async(self):
+        import asyncio
+
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self._write_config(filename, '''
+            [sec]
+            foo = foo1
+        ''')
+        self.define_opt('sec', 'foo')
+
+        async def main():
+            await self.scope.async_parse_config(filename)
+            self.scope.publish_snapshot()
+
+            snapshots = self.scope.watch_config_async(filename, interval=0.01)
+            next_snapshot = asyncio.ensure_future(snapshots.__anext__())
+            await asyncio.sleep(0.05)
+            self._write_config(filename, '''
+                [sec]
+                foo = foo22
+            ''')
+            snapshot = await asyncio.wait_for(next_snapshot, 5)
+            await snapshots.aclose()
+            return snapshot
+
+        try:
+            self.assertEqual(asyncio.run(main()).sec.foo, 'foo22')
+        finally:
+            os.unlink(filename)
+
+    def test_commands(self):
+        loaded = []
+
+        def load_push():
+            loaded.append('push')
+            self.define_opt('push', 'force', type=bool, cmd_name='force', cmd_short_name='f')
+            self.define_opt('push', 'remote', cmd_name='remote')
+
+        def load_pull():
+            loaded.append('pull')
+            self.define_opt('pull', 'rebase', type=bool, cmd_name='rebase')
+
+        self.define_opt('main', 'verbose', type=bool, cmd_name='verbose', cmd_short_name='v')
+        self.scope.define_command('push', load_push, help='Push changes')
+        self.scope.define_command('pull', load_pull, help='Pull changes')
+
+        self.assertRaises(OptionsError, self.scope.define_command, 'push', load_push)
+        self.assertIn('Commands:', self.usage('prog'))
+        self.assertIn('push  Push changes', self.usage('prog'))
+
+        self.define_opt('main', 'help', type=bool, cmd_name='help', cmd_short_name='h', is_help=True)
+        for argv in (['--help'], ['-v', '-h']):
+            with self.assertRaises(SystemExit) as cm:
+                self.init_options(argv)
+            self.assertEqual(cm.exception.code, 0)
+        self.assertEqual(loaded, [])
+
+        self.assertRaises(OptionsUserError, self.parse_args, [])
+        self.assertRaises(OptionsUserError, self.parse_args, ['fetch'])
+        self.assertRaises(OptionsUserError, self.parse_args, ['push', '--rebase'])
+        self.assertEqual(loaded, ['push'])
+
+        self.parse_args(['-v', 'push', '-f', '--remote=origin', '--verbose'])
+        self.assertEqual(loaded, ['push'])
+        self.assertEqual(self.scope.get_command(), 'push')
+        self.assertTrue(self.options.main.verbose)
+        self.assertTrue(self.options.push.force)
+        self.assertEqual(self.options.push.remote, 'origin')
+        self.assertFalse(hasattr(self.options, 'pull'))
+
+        usage = self.usage('prog')
+        self.assertIn('prog push', usage)
+        self.assertIn('--remote', usage)
+        self.assertNotIn('Commands:', usage)
+
+        self.set_defaults()
+        self.verify_all_options()
+
+    def test_unresolved_tracking(self):
+        self.define_opt('sec', 'a', type=int, cmd_name='a')
+        self.define_opt('sec', 'b', type=int, cmd_name='b')
+        self.define_opt('sec', 'c', type=int, default=3)
+
+        try:
+            self.verify_all_options()
+        except OptionsUserError as e:
+            self.assertEqual(e.errors, [
+                'Required command line option --a was not specified, and sec.a could not be found in the config file.',
+                'Required command line option --b was not specified, and sec.b could not be found in the config file.',
+            ])
+        else:
+            self.fail('OptionsUserError not raised')
+
+        self.parse_args(['--a=1', '--b=2'])
+        self.set_defaults()
+        self.verify_all_options()
+        self.assertEqual((self.options.sec.a, self.options.sec.b, self.options.sec.c), (1, 2, 3))
+
+        # Values assigned directly on the options object count as specified
+        self.define_opt('sec', 'd')
+        self.options.sec.d = 'direct'
+        self.verify_all_options()
+
+    def test_converters(self):
+        self.assertEqual(duration('30s'), 30)
+        self.assertEqual(duration('1h30m'), 5400)
+        self.assertEqual(duration('250ms'), 0.25)
+        self.assertEqual(byte_size('512MiB'), 512 * 1024 ** 2)
+        self.assertEqual(byte_size('1.5kB'), 1500)
+        self.assertRaises(ValueError, duration, '5x')
+        self.assertRaises(ValueError, byte_size, 'MiB')
+        self.assertRaises(ValueError, ListOf(int), '10-5')
+
+        self.define_opt('svc', 'ports', type=ListOf(int), cmd_name='ports')
+        self.define_opt('svc', 'weights', type=ListOf(float), default=None)
+        self.define_opt('svc', 'tags', type=SetOf(str), default=set())
+        self.define_opt('svc', 'names', type=list, default=['a', 'b'])
+        self.define_opt('svc', 'timeout', type=duration)
+        self.define_opt('svc', 'buffer', type=byte_size, default=4096)
+
+        self.assertIn('names = a, b', self.generate_sample_config())
+
+        conf = """
+        [svc]
+        ports = 80, 8000-8003
+        weights = 0.5, 1.5
+        tags = a, b, a
+        timeout = 5m
+        buffer = 512MiB
+        """
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self._write_config(filename, conf)
+        try:
+            self.parse_config(filename)
+        finally:
+            os.unlink(filename)
+        self.set_defaults()
+
+        self.assertEqual(self.options.svc.ports.typecode, 'q')
+        self.assertEqual(list(self.options.svc.ports), [80, 8000, 8001, 8002, 8003])
+        self.assertEqual(list(self.options.svc.weights), [0.5, 1.5])
+        self.assertEqual(self.options.svc.tags, {'a', 'b'})
+        self.assertEqual(self.options.svc.names, ['a', 'b'])
+        self.assertEqual(self.options.svc.timeout, 300)
+        self.assertEqual(self.options.svc.buffer, 512 * 1024 ** 2)
+
+        # Memoized conversions are copied, so mutating a value does not affect others
+        self.options.svc.ports.append(1)
+        scope = OptionsMeta(lambda s: None)
+        scope.define_opt('svc', 'ports', type=ListOf(int), cmd_name='ports')
+        scope.parse_args(['--ports=80,8000-8003'])
+        self.parse_args(['--ports=80,8000-8003'])
+        self.assertEqual(list(self.options.svc.ports), [80, 8000, 8001, 8002, 8003])
+        self.assertEqual(list(scope.options.svc.ports), [80, 8000, 8001, 8002, 8003])
+        self.assertRaises(OptionsUserError, self.parse_args, ['--ports=80,x'])
+
+        class Level(object):
+            pass
+
+        levels = []
+        scope.register_converter(Level, lambda s: levels.append(s) or s.upper())
+        scope.define_opt('log', 'level', type=Level, cmd_name='level')
+        scope.parse_args(['--level=debug'])
+        scope.parse_args(['--level=debug'])
+        self.assertEqual(scope.options.log.level, 'DEBUG')
+        self.assertEqual(levels, ['debug'])
+
+        # Items of lists are converted with the scope's converters too
+        scope.define_opt('log', 'levels', type=ListOf(Level), cmd_name='levels')
+        scope.define_opt('log', 'ints', type=SetOf(int), cmd_name='ints')
+        scope.register_converter(int, lambda s: int(s, 16))
+        scope.parse_args(['--levels=info, warn', '--ints=a,ff'])
+        self.assertEqual(scope.options.log.levels, ['INFO', 'WARN'])
+        self.assertEqual(scope.options.log.ints, set([10, 255]))
+
+        scope.define_opt('log', 'name', cmd_name='name')
+        scope.register_converter(str, str.strip)
+        scope.parse_args(['--name= app '])
+        self.assertEqual(scope.options.log.name, 'app')
+
+        # The sample configuration follows converters registered after it was generated
+        self.scope.register_converter(list, ListOf(str, ';'))
+        self.assertIn('names = a; b', self.generate_sample_config())
+
+    def test_compiled_options(self):
+        def define(scope):
+            scope.define_opt('db', 'host', cmd_name='host')
+            scope.define_opt('db', 'port', type=int, default=5432)
+            scope.define_opt('db', 'shards', type=ListOf(int))
+            scope.define_opt('main', 'config', cmd_name='config', is_config_file=True)
+            scope.define_opt('main', 'verbose', type=bool, cmd_name='verbose', cmd_only=True)
+            scope.define_opt('main', 'level', type=int, cmd_name='level', cmd_only=True, default=2)
+
+        tmpdir = tempfile.mkdtemp()
+        config_file = os.path.join(tmpdir, 'app.conf')
+        compiled = os.path.join(tmpdir, 'app.compiled')
+        self._write_config(config_file, """
+        [db]
+        host = db.example.com
+        shards = 1-4
+        """)
+
+        try:
+            scope = OptionsMeta(lambda s: None)
+            define(scope)
+            self.assertRaises(OptionsError, scope.compile_options, compiled)
+            scope.init_options(['--config', config_file])
+            scope.compile_options(compiled)
+
+            scope = OptionsMeta(lambda s: None)
+            define(scope)
+            scope.init_options(['--host=localhost'], compiled=compiled)
+            self.assertEqual(scope.options.db.host, 'localhost')
+            self.assertEqual(scope.options.db.port, 5432)
+            self.assertEqual(list(scope.options.db.shards), [1, 2, 3, 4])
+            self.assertEqual(scope.option_source('db', 'shards'), config_file)
+            self.assertFalse(hasattr(scope.options.main, 'config'))
+            self.assertIs(scope.options.main.verbose, False)
+            self.assertEqual(scope.options.main.level, 2)
+
+            scope = OptionsMeta(lambda s: None)
+            define(scope)
+            scope.init_options(['--verbose', '--level=5'], compiled=compiled)
+            self.assertIs(scope.options.main.verbose, True)
+            self.assertEqual(scope.options.main.level, 5)
+
+            scope = OptionsMeta(lambda s: None)
+            define(scope)
+            scope.define_opt('db', 'user', default='app')
+            self.assertRaises(OptionsError, scope.init_options, [], compiled=compiled)
+            self.assertRaises(OptionsError, scope.load_compiled, config_file)
+        finally:
+            for name in os.listdir(tmpdir):
+                os.unlink(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+
+    def test_validate_files(self):
+        tmpdir = tempfile.mkdtemp()
+        with open(os.path.join(tmpdir, 'groper_test_schema.py'), 'w') as fp:
+            fp.write('from groper import OptionsMeta\n')
+            fp.write('scope = OptionsMeta(lambda s: None)\n')
+            fp.write('scope.define_opt("db", "port", type=int)\n')
+            fp.write('scope.define_opt("db", "timeout", type=float, default=1.0)\n')
+            fp.write('scope.define_opt("main", "name", cmd_name="name")\n')
+
+        configs = os.path.join(tmpdir, 'conf.d')
+        os.mkdir(configs)
+        for i in range(6):
+            self._write_config(os.path.join(configs, 'host{0}.conf'.format(i)), """
+            [db]
+            port = {0}
+            timeout = 1.5
+            """.format(i))
+        self._write_config(os.path.join(configs, 'bad.conf'), """
+        [db]
+        port = x
+        timeout = y
+        """)
+        self._write_config(os.path.join(configs, 'missing.conf'), """
+        [db]
+        timeout = 1
+        """)
+        self._write_config(os.path.join(configs, 'nosection.conf'), """
+        [other]
+        timeout = 1
+        """)
+
+        sys.path.insert(0, tmpdir)
+        try:
+            results = validate_files('groper_test_schema:scope', [configs, os.path.join(tmpdir, 'nonexistent.conf')], max_workers=2)
+            self.assertEqual(len(results), 10)
+            self.assertEqual(len(results[os.path.join(configs, 'bad.conf')]), 2)
+            self.assertEqual(len(results[os.path.join(configs, 'missing.conf')]), 1)
+            self.assertEqual(results[os.path.join(configs, 'nosection.conf')], ['Required option db.port was not specified in the config file.'])
+            self.assertIn('Could not read', results[os.path.join(tmpdir, 'nonexistent.conf')][0])
+            self.assertEqual(sum(1 for errors in results.values() if errors), 4)
+            self.assertEqual(results, validate_files('groper_test_schema:scope', [configs, os.path.join(tmpdir, 'nonexistent.conf')], max_workers=1))
+
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                status = _main(['validate', '--schema=groper_test_schema:scope', '-j', '1', os.path.join(configs, '*.conf')])
+            report = json.loads(stdout.getvalue())
+            self.assertEqual(status, 1)
+            self.assertEqual((report['checked'], report['invalid']), (9, 3))
+
+            with contextlib.redirect_stderr(io.StringIO()):
+                self.assertEqual(_main(['validate', configs]), os.EX_USAGE)
+                self.assertEqual(_main(['validate', '--schema=groper_test_schema:nothing', configs]), os.EX_USAGE)
+        finally:
+            sys.path.remove(tmpdir)
+            sys.modules.pop('groper_test_schema', None)
+            for dirpath, dirnames, filenames in os.walk(tmpdir, topdown=False):
+                for name in filenames:
+                    os.unlink(os.path.join(dirpath, name))
+                for name in dirnames:
+                    os.rmdir(os.path.join(dirpath, name))
+            os.rmdir(tmpdir)
+
+    def test_interpolation(self):
+        # Values of a str subclass are not memoized, so the converter sees every evaluation
+        class Path(str):
+            pass
+
+        evaluated = []
+        self.scope.register_converter(Path, lambda raw: evaluated.append(raw) or Path(raw))
+
+        self.define_opt('paths', 'base', cmd_name='base')
+        self.define_opt('paths', 'logs', default='${base}/logs', interpolate=True)
+        self.define_opt('paths', 'cache', type=Path, interpolate=True)
+        self.define_opt('server', 'host', default='localhost')
+        self.define_opt('server', 'port', type=int, default=8080)
+        self.define_opt('server', 'url', type=Path, interpolate=True)
+        self.define_opt('server', 'next_port', type=int, interpolate=True)
+        self.define_opt('server', 'price', default='$$5', interpolate=True)
+        self.define_opt('server', 'plain')
+
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self._write_config(filename, """
+        [paths]
+        base = /srv/app
+        cache = ${paths.logs}/../cache
+        [server]
+        url = http://${server.host}:${port}${paths.base}
+        next_port = 1${port}
+        plain = ${server.host}
+        """)
+
+        try:
+            self.parse_args(['--base=/opt/app'])
+            self.parse_config(filename)
+            self.set_defaults()
+            self.verify_all_options()
+
+            self.assertEqual(self.options.paths.logs, '/opt/app/logs')
+            self.assertEqual(self.options.paths.cache, '/opt/app/logs/../cache')
+            self.assertEqual(self.options.server.url, 'http://localhost:8080/opt/app')
+            self.assertEqual(self.options.server.next_port, 18080)
+            self.assertEqual(self.options.server.price, '$5')
+            self.assertEqual(self.options.server.plain, '${server.host}')
+            self.assertEqual(sorted(evaluated), ['/opt/app/logs/../cache', 'http://localhost:8080/opt/app'])
+
+            # Only the options downstream of a changed value are evaluated again
+            del evaluated[:]
+            self._write_config(filename, """
+            [paths]
+            base = /srv/app
+            cache = ${paths.logs}/../cache
+            [server]
+            port = 9090
+            url = http://${server.host}:${port}${paths.base}
+            next_port = 1${port}
+            plain = ${server.host}
+            """)
+            changes = self.scope.reload_config(filename)
+            self.assertEqual(set(changes), set([('server', 'port'), ('server', 'url'), ('server', 'next_port')]))
+            self.assertEqual(self.options.server.url, 'http://localhost:9090/opt/app')
+            self.assertEqual(evaluated, ['http://localhost:9090/opt/app'])
+        finally:
+            os.unlink(filename)
+
+        scope = OptionsMeta(lambda s: None)
+        scope.define_opt('a', 'x', default='${y}', interpolate=True)
+        scope.define_opt('a', 'y', default='${a.x}', interpolate=True)
+        scope.set_defaults()
+        self.assertRaises(OptionsUserError, scope.verify_all_options)
+
+        scope = OptionsMeta(lambda s: None)
+        scope.define_opt('a', 'x', default='${b.nothing}', interpolate=True)
+        scope.set_defaults()
+        self.assertRaises(OptionsUserError, scope.verify_all_options)
+
+    def test_response_files(self):
+        self.define_opt('main', 'verbose', type=bool, cmd_name='verbose')
+        self.define_args((-2, 'file'), response_files=True)
+
+        tmpdir = tempfile.mkdtemp()
+        listing = os.path.join(tmpdir, 'files.txt')
+        with open(listing, 'w') as fp:
+            fp.write('a.txt\nwith space.txt\n\nb.txt\n')
+
+        consumed = []
+        stdin = sys.stdin
+        try:
+            self.parse_args(['--verbose', 'first', '@' + listing, '@@literal'])
+            self.verify_all_options()
+            self.assertEqual(self.cmdargs, [])
+            self.assertEqual(list(self.scope.iter_args()), ['first', 'a.txt', 'with space.txt', 'b.txt', '@literal'])
+            self.assertEqual(list(self.scope.iter_args()), [])
+
+            self.assertRaises(OptionsUserError, self.parse_args, ['@' + os.path.join(tmpdir, 'missing.txt')])
+
+            # Files are read lazily, so checking the count only reads what it needs
+            def lines():
+                for i in range(100000):
+                    consumed.append(i)
+                    yield 'file{0}\n'.format(i)
+            sys.stdin = lines()
+            self.parse_args(['@-'])
+            self.verify_all_options()
+            self.verify_all_options()
+            self.assertEqual(len(consumed), 1)
+            self.assertEqual(next(self.scope.iter_args()), 'file0')
+
+            scope = OptionsMeta(lambda s: None)
+            scope.define_args(('src', 'dst'), stdin=True)
+            sys.stdin = iter(['x\n', 'y\n', 'z\n'])
+            scope.parse_args([])
+            self.assertRaises(OptionsUserError, scope.verify_all_options)
+            sys.stdin = iter(['x\n', 'y\n'])
+            scope.parse_args([])
+            scope.verify_all_options()
+            self.assertEqual(list(scope.iter_args()), ['x', 'y'])
+            scope.parse_args(['a', 'b'])
+            self.assertEqual(list(scope.iter_args()), ['a', 'b'])
+        finally:
+            sys.stdin = stdin
+            os.unlink(listing)
+            os.rmdir(tmpdir)
+
 
 tests_all = unittest.TestLoader().loadTestsFromTestCase(GroperTest)
 